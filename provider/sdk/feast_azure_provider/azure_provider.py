@@ -1,11 +1,27 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT license.
 
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
 from datetime import datetime, timedelta
-from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 import pandas
 import pyarrow as pa
+from pydantic import StrictInt
 from tqdm import tqdm
 
 from feast import FeatureService
@@ -15,25 +31,50 @@ from feast.feature_view import FeatureView
 from feast.infra.offline_stores.offline_store import RetrievalJob
 from feast.infra.offline_stores.offline_utils import get_offline_store_from_config
 from feast.infra.online_stores.helpers import get_online_store_from_config
-from feast.infra.provider import (
-    Provider,
-    _convert_arrow_to_proto,
-    _get_column_names,
-    _run_field_mapping,
-)
+from feast.infra.provider import Provider, _get_column_names, _run_field_mapping
 from feast.protos.feast.types.EntityKey_pb2 import EntityKey as EntityKeyProto
 from feast.protos.feast.types.Value_pb2 import Value as ValueProto
 from feast.registry import Registry
-from feast.repo_config import RepoConfig
+from feast.repo_config import FeastBaseModel, RepoConfig
 from feast.saved_dataset import SavedDataset
 from feast.usage import RatioSampler, log_exceptions_and_usage, set_usage_attribute
 from feast.utils import make_tzaware
 
+from .proto_conversion import convert_arrow_to_proto
+from .utils import read_ahead, read_ahead_parallel
+
 DEFAULT_BATCH_SIZE = 10_000
 
+
+class AzureProviderConfig(FeastBaseModel):
+    """Provider config for Azure, read from the `azure_provider` section of the repo config"""
+
+    materialization_queue_depth: StrictInt = 4
+    """ Number of batches buffered between the fetch, conversion and write stages of
+     materialization. 0 runs the stages serially on the calling thread"""
+
+    materialization_write_concurrency: StrictInt = 1
+    """ Number of threads writing converted batches to the online store"""
+
+    materialization_conversion_processes: StrictInt = 0
+    """ Number of processes converting Arrow batches to protos. 0 converts on the calling thread.
+     The protos are parsed again on the calling thread, which costs about as much as converting them"""
+
+    materialization_time_slices: StrictInt = 1
+    """ Number of time slices the materialization window of a feature view is split into,
+     each pulled from the offline store in parallel"""
+
+    materialization_max_sql_connections: StrictInt = 4
+    """ Maximum number of time slices of a feature view read from the offline store at once"""
+
+
 class AzureProvider(Provider):
     def __init__(self, config: RepoConfig):
         self.repo_config = config
+        provider_config = getattr(config, "azure_provider", None) or {}
+        if isinstance(provider_config, dict):
+            provider_config = AzureProviderConfig(**provider_config)
+        self.provider_config = provider_config
         self.offline_store = get_offline_store_from_config(config.offline_store)
         self.online_store = (
             get_online_store_from_config(config.online_store)
@@ -104,7 +145,7 @@ class AzureProvider(Provider):
             table = _run_field_mapping(table, feature_view.batch_source.field_mapping)
 
         join_keys = {entity.join_key: entity.value_type for entity in entities}
-        rows_to_write = _convert_arrow_to_proto(table, feature_view, join_keys)
+        rows_to_write = convert_arrow_to_proto(table, feature_view, join_keys)
 
         self.online_write_batch(
             self.repo_config, feature_view, rows_to_write, progress=None
@@ -131,33 +172,167 @@ class AzureProvider(Provider):
             created_timestamp_column,
         ) = _get_column_names(feature_view, entities)
 
-        offline_job = self.offline_store.pull_latest_from_table_or_query(
-            config=config,
-            data_source=feature_view.batch_source,
-            join_key_columns=join_key_columns,
-            feature_name_columns=feature_name_columns,
-            event_timestamp_column=event_timestamp_column,
-            created_timestamp_column=created_timestamp_column,
-            start_date=start_date,
-            end_date=end_date,
+        def pull_latest(slice_start: datetime, slice_end: datetime) -> RetrievalJob:
+            return self.offline_store.pull_latest_from_table_or_query(
+                config=config,
+                data_source=feature_view.batch_source,
+                join_key_columns=join_key_columns,
+                feature_name_columns=feature_name_columns,
+                event_timestamp_column=event_timestamp_column,
+                created_timestamp_column=created_timestamp_column,
+                start_date=slice_start,
+                end_date=slice_end,
+            )
+
+        time_slices = _split_time_range(
+            start_date, end_date, self.provider_config.materialization_time_slices
         )
+        if len(time_slices) > 1:
+            # Each slice only holds the latest row per entity within its own range.
+            # Streaming the newest slice first, an entity's first row is its latest
+            batches = _latest_across_slices(
+                self._read_slices(
+                    [pull_latest(*time_slice) for time_slice in reversed(time_slices)]
+                ),
+                join_key_columns,
+            )
+        else:
+            batches = _arrow_batches(pull_latest(start_date, end_date))
 
-        table = offline_job.to_arrow()
+        join_keys = {entity.join_key: entity.value_type for entity in entities}
 
-        if feature_view.batch_source.field_mapping is not None:
-            table = _run_field_mapping(table, feature_view.batch_source.field_mapping)
+        def tables():
+            for batch in batches:
+                if batch.num_rows == 0:
+                    continue
+                table = pa.Table.from_batches([batch])
+                if feature_view.batch_source.field_mapping is not None:
+                    table = _run_field_mapping(
+                        table, feature_view.batch_source.field_mapping
+                    )
+                yield table
 
-        join_keys = {entity.join_key: entity.value_type for entity in entities}
-        
-        with tqdm_builder(table.num_rows) as pbar:
-            for batch in table.to_batches(DEFAULT_BATCH_SIZE):
-                rows_to_write = _convert_arrow_to_proto(batch, feature_view, join_keys)
+        # The total number of rows isn't known up front, so grow the bar as we go
+        with tqdm_builder(0) as pbar:
+            self._write_tables_to_online_store(
+                feature_view, join_keys, tables(), pbar
+            )
+
+    def _read_slices(
+        self, offline_jobs: List[RetrievalJob]
+    ) -> Iterator[Tuple[int, pa.RecordBatch]]:
+        """
+        Streams the batches of the offline jobs in order, with the index of their job.
+        Up to `materialization_max_sql_connections` jobs are read ahead concurrently.
+        """
+        parallelism = max(self.provider_config.materialization_max_sql_connections, 1)
+
+        def indexed(index: int) -> Iterator[Tuple[int, pa.RecordBatch]]:
+            for batch in _arrow_batches(offline_jobs[index]):
+                yield index, batch
+
+        for first in range(0, len(offline_jobs), parallelism):
+            yield from read_ahead_parallel(
+                [
+                    indexed(index)
+                    for index in range(
+                        first, min(first + parallelism, len(offline_jobs))
+                    )
+                ],
+                depth=2,
+            )
+
+    def _write_tables_to_online_store(
+        self,
+        feature_view: FeatureView,
+        join_keys: Dict[str, Any],
+        tables: Iterable[pa.Table],
+        pbar: tqdm,
+    ) -> None:
+        """
+        Converts and writes Arrow tables to the online store as a pipeline: tables are
+        fetched ahead on a background thread, converted to protos (optionally in a
+        process pool) and written by a pool of threads, with at most
+        `materialization_queue_depth` batches in flight between stages.
+        """
+        settings = self.provider_config
+        depth = settings.materialization_queue_depth
+
+        def progress(n: int):
+            pbar.update(n)
+
+        if depth <= 0:
+            for table in tables:
+                pbar.total += table.num_rows
+                pbar.refresh()
+                rows_to_write = convert_arrow_to_proto(table, feature_view, join_keys)
                 self.online_write_batch(
-                    self.repo_config,
-                    feature_view,
-                    rows_to_write,
-                    lambda x: pbar.update(x),
+                    self.repo_config, feature_view, rows_to_write, progress
+                )
+            return
+
+        with ExitStack() as stack:
+            writers = stack.enter_context(
+                ThreadPoolExecutor(
+                    max_workers=max(settings.materialization_write_concurrency, 1)
+                )
+            )
+            converters = (
+                stack.enter_context(
+                    # Forking while the read-ahead, janitor and registry refresher
+                    # threads run could copy locks they hold into the workers
+                    ProcessPoolExecutor(
+                        max_workers=settings.materialization_conversion_processes,
+                        mp_context=multiprocessing.get_context("spawn"),
+                    )
                 )
+                if settings.materialization_conversion_processes > 0
+                else None
+            )
+
+            conversions: deque = deque()
+            writes: deque = deque()
+
+            def write(rows_to_write):
+                writes.append(
+                    writers.submit(
+                        self.online_write_batch,
+                        self.repo_config,
+                        feature_view,
+                        rows_to_write,
+                        progress,
+                    )
+                )
+                # Bound the number of converted batches waiting to be written, and
+                # surface write errors as early as possible
+                while len(writes) > depth:
+                    writes.popleft().result()
+
+            for table in read_ahead(tables, depth):
+                pbar.total += table.num_rows
+                pbar.refresh()
+
+                if converters is None:
+                    write(convert_arrow_to_proto(table, feature_view, join_keys))
+                    continue
+
+                conversions.append(
+                    converters.submit(
+                        _convert_arrow_to_serialized_proto,
+                        table,
+                        feature_view,
+                        join_keys,
+                    )
+                )
+                while len(conversions) > depth or (
+                    conversions and conversions[0].done()
+                ):
+                    write(_parse_serialized_protos(conversions.popleft().result()))
+
+            while conversions:
+                write(_parse_serialized_protos(conversions.popleft().result()))
+            while writes:
+                writes.popleft().result()
 
     def get_historical_features(
         self,
@@ -168,7 +343,13 @@ class AzureProvider(Provider):
         registry: Registry,
         project: str,
         full_feature_names: bool,
+        point_in_time_join_mode: Optional[str] = None,
     ) -> RetrievalJob:
+        # Only the SQL Server offline store takes a point-in-time join mode, without
+        # one it uses the mode of its config
+        kwargs = {}
+        if point_in_time_join_mode is not None:
+            kwargs["point_in_time_join_mode"] = point_in_time_join_mode
         job = self.offline_store.get_historical_features(
             config=config,
             feature_views=feature_views,
@@ -177,6 +358,7 @@ class AzureProvider(Provider):
             registry=registry,
             project=project,
             full_feature_names=full_feature_names,
+            **kwargs,
         )
         return job
 
@@ -245,7 +427,90 @@ class AzureProvider(Provider):
             data_source=logging_config.destination.to_data_source(),
             join_key_columns=[],
             feature_name_columns=columns,
-            timestamp_field=ts_column,
+            event_timestamp_column=ts_column,
             start_date=make_tzaware(start_date),
             end_date=make_tzaware(end_date),
-        )
\ No newline at end of file
+        )
+
+
+def _split_time_range(
+    start_date: datetime, end_date: datetime, slices: int
+) -> List[Tuple[datetime, datetime]]:
+    """Splits [start_date, end_date] into contiguous, equally sized time slices"""
+    if slices <= 1 or end_date <= start_date:
+        return [(start_date, end_date)]
+
+    step = (end_date - start_date) / slices
+    boundaries = [start_date + step * i for i in range(slices)] + [end_date]
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def _convert_arrow_to_serialized_proto(
+    table: pa.Table, feature_view: FeatureView, join_keys: Dict[str, Any]
+) -> List[Tuple[bytes, Dict[str, bytes], datetime, Optional[datetime]]]:
+    """
+    convert_arrow_to_proto for the conversion processes. Feast's proto classes are
+    registered under a different module than the one they are imported from, so they
+    can't be pickled back to the parent process and are returned serialized instead.
+    """
+    rows = convert_arrow_to_proto(table, feature_view, join_keys)
+    return [
+        (
+            entity_key.SerializeToString(),
+            {name: value.SerializeToString() for name, value in values.items()},
+            event_timestamp,
+            created_timestamp,
+        )
+        for entity_key, values, event_timestamp, created_timestamp in rows
+    ]
+
+
+def _parse_serialized_protos(
+    rows: List[Tuple[bytes, Dict[str, bytes], datetime, Optional[datetime]]]
+) -> List[Tuple[EntityKeyProto, Dict[str, ValueProto], datetime, Optional[datetime]]]:
+    return [
+        (
+            EntityKeyProto.FromString(entity_key),
+            {name: ValueProto.FromString(value) for name, value in values.items()},
+            event_timestamp,
+            created_timestamp,
+        )
+        for entity_key, values, event_timestamp, created_timestamp in rows
+    ]
+
+
+def _arrow_batches(offline_job: RetrievalJob) -> Iterator[pa.RecordBatch]:
+    # Stream the offline result when the job supports it so that memory stays flat
+    # regardless of the size of the materialization window
+    if hasattr(offline_job, "to_arrow_batches"):
+        yield from offline_job.to_arrow_batches(DEFAULT_BATCH_SIZE)
+    else:
+        yield from offline_job.to_arrow().to_batches(DEFAULT_BATCH_SIZE)
+
+
+def _latest_across_slices(
+    batches: Iterable[Tuple[int, pa.RecordBatch]], join_key_columns: List[str]
+) -> Iterator[pa.RecordBatch]:
+    """
+    Streams the latest row of every entity out of the batches of time slices, given
+    newest slice first along with the index of their slice. Every slice holds the
+    latest row of its entities within its own range, so the rows of entities seen in
+    a newer slice are dropped. Only the entity keys are kept in memory.
+    """
+    seen: set = set()
+    slice_keys: set = set()
+    current_slice = None
+    for slice_index, batch in batches:
+        if slice_index != current_slice:
+            seen.update(slice_keys)
+            slice_keys = set()
+            current_slice = slice_index
+        key_columns = [batch.column(column).to_pylist() for column in join_key_columns]
+        keys = list(zip(*key_columns)) if key_columns else [()] * batch.num_rows
+        slice_keys.update(keys)
+        if not seen:
+            yield batch
+            continue
+        mask = [key not in seen for key in keys]
+        if any(mask):
+            yield batch.filter(pa.array(mask))
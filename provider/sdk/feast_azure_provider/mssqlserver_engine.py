@@ -0,0 +1,166 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+# (pool_size, max_overflow, pool_pre_ping, pool_recycle, pool_timeout, fast_executemany)
+EngineOptions = Tuple[int, int, bool, int, int, bool]
+
+DEFAULT_ENGINE_OPTIONS: EngineOptions = (5, 10, False, -1, 30, True)
+
+_engines: Dict[str, Dict[EngineOptions, Engine]] = {}
+_metrics: Dict[str, "PoolMetrics"] = {}
+_executors: Dict[Engine, ThreadPoolExecutor] = {}
+_lock = threading.Lock()
+
+
+class PoolMetrics:
+    """
+    Connection checkout statistics of the pools created for a connection string. The
+    checkout time includes waiting for a free connection and opening new ones.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_checkout_seconds = 0.0
+        self.max_checkout_seconds = 0.0
+
+    def record_checkout(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            self.total_checkout_seconds += seconds
+            self.max_checkout_seconds = max(self.max_checkout_seconds, seconds)
+
+    def to_dict(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "total_checkout_seconds": self.total_checkout_seconds,
+                "mean_checkout_seconds": self.total_checkout_seconds
+                / max(self.checkouts, 1),
+                "max_checkout_seconds": self.max_checkout_seconds,
+            }
+
+
+class _TimedQueuePool(QueuePool):
+    """
+    QueuePool recording how long every checkout takes. Subclassed per connection string
+    with its metrics, as SQLAlchemy recreates pools from their class.
+    """
+
+    _metrics: PoolMetrics
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self._metrics.record_checkout(time.perf_counter() - start, timed_out=True)
+            raise
+        self._metrics.record_checkout(time.perf_counter() - start)
+        return connection
+
+
+def get_engine(
+    connection_string: str, options: Optional[EngineOptions] = None
+) -> Engine:
+    """
+    Returns the process-wide engine of a connection string, creating it on first use.
+    Engines are shared by every offline store and data source of the process, so
+    connections are pooled across calls. Without options, any engine already created
+    for the connection string is returned.
+    """
+    with _lock:
+        engines = _engines.setdefault(connection_string, {})
+        if options is None:
+            if engines:
+                return next(iter(engines.values()))
+            options = DEFAULT_ENGINE_OPTIONS
+
+        engine = engines.get(options)
+        if engine is None:
+            engine = _create_engine(connection_string, options)
+            engines[options] = engine
+        return engine
+
+
+def get_query_executor(engine: Engine) -> ThreadPoolExecutor:
+    """
+    Returns the thread pool running blocking queries of an engine for asyncio callers.
+    It has as many threads as the engine can open connections, so awaiting queries
+    queue up in the executor rather than while checking out connections.
+    """
+    with _lock:
+        executor = _executors.get(engine)
+        if executor is None:
+            pool = engine.pool
+            max_workers = (
+                pool.size() + max(pool._max_overflow, 0)
+                if isinstance(pool, QueuePool)
+                else DEFAULT_ENGINE_OPTIONS[0] + DEFAULT_ENGINE_OPTIONS[1]
+            )
+            executor = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="feast-mssql"
+            )
+            _executors[engine] = executor
+        return executor
+
+
+def get_pool_metrics(connection_string: str) -> Dict[str, float]:
+    """Returns the checkout statistics of the engines of a connection string"""
+    with _lock:
+        metrics = _metrics.get(connection_string)
+    return metrics.to_dict() if metrics else PoolMetrics().to_dict()
+
+
+def dispose_engines():
+    """Closes the pooled connections of every engine and forgets the engines"""
+    with _lock:
+        engines = [e for by_options in _engines.values() for e in by_options.values()]
+        _engines.clear()
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=False)
+    for engine in engines:
+        engine.dispose()
+
+
+def _create_engine(connection_string: str, options: EngineOptions) -> Engine:
+    (
+        pool_size,
+        max_overflow,
+        pool_pre_ping,
+        pool_recycle,
+        pool_timeout,
+        fast_executemany,
+    ) = options
+    engine_kwargs = {}
+    if fast_executemany and make_url(connection_string).get_driver_name() == "pyodbc":
+        engine_kwargs["fast_executemany"] = True
+
+    metrics = _metrics.setdefault(connection_string, PoolMetrics())
+    return create_engine(
+        connection_string,
+        poolclass=type("TimedQueuePool", (_TimedQueuePool,), {"_metrics": metrics}),
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_pre_ping=pool_pre_ping,
+        pool_recycle=pool_recycle,
+        pool_timeout=pool_timeout,
+        **engine_kwargs,
+    )
@@ -0,0 +1,223 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import hashlib
+import threading
+import time
+import uuid
+import weakref
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+import pandas
+import sqlalchemy
+from sqlalchemy.engine import Engine
+
+# Prefix of the tables entity dataframes are staged into, as named by
+# feast.infra.offline_stores.offline_utils.get_temp_entity_table_name
+ENTITY_TABLE_PREFIX = "feast_entity_df_"
+
+_managers: Dict[Engine, "StagedEntityTables"] = {}
+_managers_lock = threading.Lock()
+
+
+class StagedEntityTables:
+    """
+    Reference counts the entity tables staged by this process on a database. A table
+    is uploaded by its first user and dropped once the last one releases it, so that
+    concurrent retrievals of the same entity dataframe share a single upload.
+
+    Tables are only shared while they are referenced: retrieval jobs release theirs
+    once their result is read, so retrievals of the same dataframe made one after the
+    other, like get_historical_features(...).to_df(), each upload it again.
+    """
+
+    def __init__(self, engine: Engine):
+        self._engine = engine
+        # Tables of other processes never share names with ours, as they may drop them
+        self._process_token = uuid.uuid4().hex[:8]
+        self._lock = threading.Lock()
+        self._table_locks: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+        self._references: Dict[str, int] = {}
+        self._janitor: Optional[threading.Thread] = None
+
+    def table_name(self, entity_df: Optional[pandas.DataFrame] = None) -> str:
+        """
+        Returns the table name of an entity dataframe, derived from its content, or a
+        new unique name if there is no dataframe.
+        """
+        if entity_df is None:
+            return f"{ENTITY_TABLE_PREFIX}{uuid.uuid4().hex}"
+
+        fingerprint = hashlib.sha256()
+        fingerprint.update(repr(list(zip(entity_df.columns, entity_df.dtypes))).encode())
+        fingerprint.update(
+            pandas.util.hash_pandas_object(entity_df, index=False).values.tobytes()
+        )
+        return f"{ENTITY_TABLE_PREFIX}{fingerprint.hexdigest()[:24]}{self._process_token}"
+
+    def acquire(self, table_name: str, upload: Callable[[str], None]):
+        """Takes a reference on a table, calling upload to create it if needed"""
+        with self._table_lock(table_name):
+            with self._lock:
+                if table_name in self._references:
+                    self._references[table_name] += 1
+                    return
+            try:
+                upload(table_name)
+            except BaseException:
+                # Names are derived from the content, so a partially uploaded table
+                # would make every retry of the same dataframe fail
+                try:
+                    _drop_tables(self._engine, [table_name])
+                except Exception:
+                    pass
+                raise
+            with self._lock:
+                self._references[table_name] = 1
+
+    def release(self, table_name: str):
+        """Releases a reference on a table, dropping it if it was the last one"""
+        with self._table_lock(table_name):
+            with self._lock:
+                references = self._references.get(table_name, 0) - 1
+                if references > 0:
+                    self._references[table_name] = references
+                    return
+                self._references.pop(table_name, None)
+            _drop_tables(self._engine, [table_name])
+
+    def start_janitor(self, ttl_seconds: int):
+        """
+        Starts a background thread dropping the staged entity tables created more than
+        ttl_seconds ago, including those left behind by other processes, unless this
+        process still uses them. Whether other processes still use their tables can't
+        be told, so ttl_seconds must exceed the duration of the longest retrieval.
+        """
+        with self._lock:
+            if self._janitor is not None:
+                return
+            self._janitor = threading.Thread(
+                target=self._clean_up_periodically, args=(ttl_seconds,), daemon=True
+            )
+            self._janitor.start()
+
+    def _clean_up_periodically(self, ttl_seconds: int):
+        while True:
+            try:
+                self.drop_stale_tables(ttl_seconds)
+            except Exception:
+                # The database may be temporarily unreachable, retry on the next run
+                pass
+            time.sleep(min(max(ttl_seconds, 60), 600))
+
+    def drop_stale_tables(self, ttl_seconds: int):
+        """Drops the staged entity tables created more than ttl_seconds ago"""
+        with self._engine.connect() as connection:
+            stale_tables = [
+                row[0]
+                for row in connection.execute(
+                    sqlalchemy.text(
+                        "SELECT name FROM sys.tables "
+                        "WHERE name LIKE :prefix AND create_date < DATEADD(SECOND, :age, GETDATE())"
+                    ),
+                    {
+                        "prefix": ENTITY_TABLE_PREFIX.replace("_", "[_]") + "%",
+                        "age": -ttl_seconds,
+                    },
+                )
+            ]
+        with self._lock:
+            stale_tables = [t for t in stale_tables if t not in self._references]
+        _drop_tables(self._engine, stale_tables)
+
+    def _table_lock(self, table_name: str) -> threading.Lock:
+        with self._lock:
+            return self._table_locks[table_name]
+
+
+class EntityTableLease:
+    """
+    A reference on a staged entity table, released by retrieval jobs once their result
+    has been read or they are closed. Leases garbage collected before then release
+    their table on a background thread. Those still held at interpreter exit leave
+    their table behind, to be dropped by the janitor if it is enabled.
+    """
+
+    def __init__(self, tables: StagedEntityTables, table_name: str):
+        self.tables = tables
+        self.table_name = table_name
+        self._lock = threading.Lock()
+        self._upload: Optional[Callable[[str], None]] = None
+        self._state = {"acquired": False}
+        self._finalizer = weakref.finalize(
+            self, _release_lease_in_background, tables, table_name, self._state
+        )
+        # Dropping the table blocks on the database, which must not delay the exit
+        self._finalizer.atexit = False
+
+    def acquire(self, upload: Callable[[str], None]):
+        with self._lock:
+            self._upload = upload
+            if not self._state["acquired"]:
+                self.tables.acquire(self.table_name, upload)
+                self._state["acquired"] = True
+
+    @contextmanager
+    def read_reference(self):
+        """
+        Holds another reference on the table while it is read, uploading it again if
+        the lease was released since.
+        """
+        if self._upload is None:
+            # Nothing was staged
+            yield
+            return
+        self.tables.acquire(self.table_name, self._upload)
+        try:
+            yield
+        finally:
+            self.tables.release(self.table_name)
+
+    def release(self):
+        with self._lock:
+            if not self._state["acquired"]:
+                return
+            self._state["acquired"] = False
+            self.tables.release(self.table_name)
+
+
+def _release_lease_in_background(
+    tables: StagedEntityTables, table_name: str, state: Dict
+):
+    if state["acquired"]:
+        threading.Thread(
+            target=_release_lease, args=(tables, table_name), daemon=True
+        ).start()
+
+
+def _release_lease(tables: StagedEntityTables, table_name: str):
+    try:
+        tables.release(table_name)
+    except Exception:
+        # The janitor drops what's left behind, if it is enabled
+        pass
+
+
+def get_staged_entity_tables(engine: Engine) -> StagedEntityTables:
+    """Returns the process-wide staged entity tables of an engine"""
+    with _managers_lock:
+        manager = _managers.get(engine)
+        if manager is None:
+            manager = StagedEntityTables(engine)
+            _managers[engine] = manager
+        return manager
+
+
+def _drop_tables(engine: Engine, tables):
+    if not tables:
+        return
+    with engine.begin() as connection:
+        for table in tables:
+            connection.execute(sqlalchemy.text(f"DROP TABLE IF EXISTS {table}"))
@@ -0,0 +1,81 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import importlib
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional
+
+from feast.infra.offline_stores.offline_store import RetrievalMetadata
+
+
+class MsSqlServerRetrievalMetadata(RetrievalMetadata):
+    """
+    Retrieval metadata extended with what was measured while running the retrieval,
+    when the offline store is configured to instrument retrievals:
+
+    * timings: seconds spent per stage (entity_upload, staging, execution, fetch and
+      arrow_conversion), accumulated over all the runs of the job
+    * row_count and arrow_bytes: size of the result
+    * statistics: SET STATISTICS IO/TIME messages, if statistics are collected
+    * query_plan: estimated plan XML of the query, if query plans are collected
+    """
+
+    def __init__(
+        self,
+        features: List[str],
+        keys: List[str],
+        min_event_timestamp: Optional[datetime] = None,
+        max_event_timestamp: Optional[datetime] = None,
+    ):
+        super().__init__(
+            features=features,
+            keys=keys,
+            min_event_timestamp=min_event_timestamp,
+            max_event_timestamp=max_event_timestamp,
+        )
+        self._lock = threading.Lock()
+        self.timings: Dict[str, float] = {}
+        self.row_count = 0
+        self.arrow_bytes = 0
+        self.statistics: List[str] = []
+        self.query_plan: Optional[str] = None
+
+    @contextmanager
+    def timed(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_timing(stage, time.perf_counter() - start)
+
+    def record_timing(self, stage: str, seconds: float):
+        with self._lock:
+            self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    def record_batch(self, row_count: int, arrow_bytes: int):
+        with self._lock:
+            self.row_count += row_count
+            self.arrow_bytes += arrow_bytes
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "features": list(self.features),
+                "keys": list(self.keys),
+                "timings": dict(self.timings),
+                "row_count": self.row_count,
+                "arrow_bytes": self.arrow_bytes,
+                "statistics": list(self.statistics),
+                "query_plan": self.query_plan,
+            }
+
+
+@lru_cache(maxsize=None)
+def load_metrics_hook(path: str) -> Callable[[MsSqlServerRetrievalMetadata], None]:
+    """Imports the metrics hook named by a dotted path, e.g. my_package.metrics.report"""
+    module_name, _, attribute = path.rpartition(".")
+    return getattr(importlib.import_module(module_name), attribute)
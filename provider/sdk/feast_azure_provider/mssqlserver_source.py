@@ -1,11 +1,14 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT license.
 
-from typing import Callable, Dict, Iterable, Optional, Tuple
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 import json
+import threading
+import time
+import warnings
+import weakref
 
 import pandas
-from sqlalchemy import create_engine
 
 from feast import type_map
 from feast.data_source import DataSource
@@ -13,6 +16,19 @@ from feast.protos.feast.core.DataSource_pb2 import DataSource as DataSourceProto
 from feast.value_type import ValueType
 from feast.repo_config import RepoConfig
 
+# Number of seconds table schemas are cached for by get_table_column_names_and_types
+SCHEMA_CACHE_TTL_SECONDS = 300
+
+# (connection string, database, table name) -> (fetch time, column names and types),
+# names are lower case as SQL Server compares them case insensitively by default
+_schema_cache: Dict[Tuple[str, str, str], Tuple[float, List[Tuple[str, str]]]] = {}
+_schema_cache_lock = threading.Lock()
+
+# Every source alive in the process, whose schemas are fetched together on first use
+_known_sources: "weakref.WeakValueDictionary[int, MsSqlServerSource]" = (
+    weakref.WeakValueDictionary()
+)
+
 
 class MsSqlServerOptions:
     """
@@ -109,6 +125,7 @@ class MsSqlServerSource(DataSource):
             connection_str=connection_str, table_ref=table_ref
         )
         self._connection_str = connection_str
+        _known_sources[id(self)] = self
 
         super().__init__(
             created_timestamp_column = created_timestamp_column,
@@ -201,21 +218,131 @@ class MsSqlServerSource(DataSource):
     def source_datatype_to_feast_value_type() -> Callable[[str], ValueType]:
         return type_map.mssqlserver_to_feast_value_type
 
-    def get_table_column_names_and_types(self) -> Iterable[Tuple[str, str]]:
-        conn = create_engine(self._connection_str)
-        name_type_pairs = []
-        database, table_name = self.table_ref.split(".")
-        columns_query = f"""
-            SELECT COLUMN_NAME, DATA_TYPE FROM {database}.INFORMATION_SCHEMA.COLUMNS
-            WHERE TABLE_NAME = '{table_name}'
-        """
-        table_schema = pandas.read_sql(columns_query, conn)
-        name_type_pairs.extend(
-            list(
-                zip(
-                    table_schema["COLUMN_NAME"].to_list(),
-                    table_schema["DATA_TYPE"].to_list(),
-                )
+    def get_table_column_names_and_types(
+        self, config: Optional[RepoConfig] = None
+    ) -> Iterable[Tuple[str, str]]:
+        key = _schema_cache_key(self)
+        if key is None:
+            raise ValueError(
+                f"Expected a table_ref like database.table and a connection_str, got "
+                f"{self.table_ref!r} and {self._mssqlserver_options.connection_str!r}"
             )
-        )
-        return name_type_pairs
+        with _schema_cache_lock:
+            cached = _schema_cache.get(key)
+        if cached is None or time.monotonic() - cached[0] > SCHEMA_CACHE_TTL_SECONDS:
+            # Feast infers the schemas of sources one at a time, e.g. during feast
+            # apply, so fetch those of the other sources on the same server too
+            prefetch_schemas(
+                [self]
+                + [
+                    source
+                    for source in list(_known_sources.values())
+                    if source is not self
+                    and source.mssqlserver_options.connection_str == key[0]
+                ]
+            )
+            with _schema_cache_lock:
+                cached = _schema_cache.get(key)
+            if cached is None:
+                # The batched query failed, fetch this table alone to raise its error
+                database, table_name = self.table_ref.split(".")
+                _fetch_schemas(key[0], database, [table_name])
+                with _schema_cache_lock:
+                    cached = _schema_cache[key]
+        return list(cached[1])
+
+
+def prefetch_schemas(sources: Iterable[MsSqlServerSource], force: bool = False):
+    """
+    Caches the column names and types of the tables of sources, with one
+    INFORMATION_SCHEMA query per connection string and database. Tables with a
+    fresh cached schema are skipped unless force is set. Sources without a
+    connection string or a database.table table_ref are skipped, and a failed query
+    only leaves the schemas of its database uncached.
+    """
+    now = time.monotonic()
+    tables_by_database: Dict[Tuple[str, str], List[str]] = {}
+    for source in sources:
+        key = _schema_cache_key(source)
+        if key is None:
+            continue
+        with _schema_cache_lock:
+            cached = _schema_cache.get(key)
+        if not force and cached and now - cached[0] <= SCHEMA_CACHE_TTL_SECONDS:
+            continue
+        database, table_name = source.table_ref.split(".")
+        tables = tables_by_database.setdefault((key[0], database), [])
+        if table_name.lower() not in (name.lower() for name in tables):
+            tables.append(table_name)
+
+    for (connection_str, database), table_names in tables_by_database.items():
+        try:
+            _fetch_schemas(connection_str, database, table_names)
+        except Exception as e:
+            warnings.warn(
+                f"Could not fetch the schemas of {', '.join(table_names)} in {database}: {e}"
+            )
+
+
+def _fetch_schemas(connection_str: str, database: str, table_names: List[str]):
+    """Caches the column names and types of tables of a database"""
+    # SQLAlchemy is only imported when schemas are actually queried
+    from sqlalchemy import bindparam, text
+
+    from .mssqlserver_engine import get_engine
+
+    columns_query = text(
+        f"""
+        SELECT TABLE_NAME, COLUMN_NAME, DATA_TYPE FROM {database}.INFORMATION_SCHEMA.COLUMNS
+        WHERE TABLE_NAME IN :table_names
+        ORDER BY TABLE_NAME, ORDINAL_POSITION
+    """
+    ).bindparams(bindparam("table_names", expanding=True))
+    table_schema = pandas.read_sql(
+        columns_query,
+        get_engine(connection_str),
+        params={"table_names": table_names},
+    )
+
+    # INFORMATION_SCHEMA may not spell names the way the sources do
+    columns: Dict[str, List[Tuple[str, str]]] = {
+        name.lower(): [] for name in table_names
+    }
+    for table_name, column_name, data_type in zip(
+        table_schema["TABLE_NAME"].to_list(),
+        table_schema["COLUMN_NAME"].to_list(),
+        table_schema["DATA_TYPE"].to_list(),
+    ):
+        columns.setdefault(table_name.lower(), []).append((column_name, data_type))
+
+    fetched_at = time.monotonic()
+    with _schema_cache_lock:
+        for table_name in table_names:
+            _schema_cache[(connection_str, database.lower(), table_name.lower())] = (
+                fetched_at,
+                columns[table_name.lower()],
+            )
+
+
+def invalidate_schema_cache(sources: Optional[Iterable[MsSqlServerSource]] = None):
+    """Forgets the cached schemas of sources, or of every table if sources is None"""
+    with _schema_cache_lock:
+        if sources is None:
+            _schema_cache.clear()
+            return
+        for source in sources:
+            _schema_cache.pop(_schema_cache_key(source), None)
+
+
+def _schema_cache_key(source: MsSqlServerSource) -> Optional[Tuple[str, str, str]]:
+    """Returns the schema cache key of a source, None if it has no table to query"""
+    connection_str = source.mssqlserver_options.connection_str
+    parts = (source.table_ref or "").split(".")
+    if not connection_str or len(parts) != 2 or not all(parts):
+        return None
+    database, table_name = parts
+    return (
+        source.mssqlserver_options.connection_str,
+        database.lower(),
+        table_name.lower(),
+    )
@@ -1,19 +1,58 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT license.
 
+import hashlib
+import json
 import os
+import threading
+import time
 import uuid
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
 
 from feast.protos.feast.core.Registry_pb2 import Registry as RegistryProto
 from feast.registry import RegistryConfig
 from feast.registry_store import RegistryStore
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from urllib.parse import urlparse
-from tempfile import TemporaryFile
 
 REGISTRY_SCHEMA_VERSION = "1"
 
+# Number of times a registry write is merged with concurrent writes and retried
+REGISTRY_WRITE_ATTEMPTS = 5
+
+# Number of blocks of the registry uploaded in parallel
+REGISTRY_UPLOAD_MAX_CONCURRENCY = int(
+    os.environ.get("REGISTRY_UPLOAD_MAX_CONCURRENCY", "4")
+)
+
+# Registries larger than a block are uploaded as blocks, in parallel
+REGISTRY_UPLOAD_BLOCK_SIZES = {
+    "max_single_put_size": 4 * 1024 * 1024,
+    "max_block_size": 4 * 1024 * 1024,
+}
+
+
+# Version of the manifest listing the shards of a registry in the sharded layout
+REGISTRY_MANIFEST_FORMAT_VERSION = 1
+
+# zstd level registry shards are compressed with
+REGISTRY_SHARD_COMPRESSION_LEVEL = int(
+    os.environ.get("REGISTRY_SHARD_COMPRESSION_LEVEL", "3")
+)
+
+# Shards no manifest lists are only deleted once they are older than this, until then
+# they may belong to a write in progress
+REGISTRY_ORPHANED_SHARD_GRACE_SECONDS = int(
+    os.environ.get("REGISTRY_ORPHANED_SHARD_GRACE_SECONDS", "3600")
+)
+
+
+class RegistryConflictError(Exception):
+    """Raised when a registry write conflicts with a concurrent one"""
+
 
 class AzBlobRegistryStore(RegistryStore):
     def __init__(self, registry_config: RegistryConfig, repo_path: Path):
@@ -33,6 +72,50 @@ class AzBlobRegistryStore(RegistryStore):
         self._container = container_path.pop(0)
         self._path = "/".join(container_path)
 
+        # Last downloaded registry and its ETag, also kept on disk in REGISTRY_CACHE_DIR
+        # so that new processes don't download an unchanged registry
+        self._cached: Optional[Tuple[Optional[str], RegistryProto]] = None
+
+        # With REGISTRY_LAYOUT=sharded, the registry is stored as one zstd compressed
+        # shard per project, listed by a manifest blob next to the registry blob. Only
+        # the shards of the projects in REGISTRY_PROJECTS, if set, are downloaded. The
+        # single blob is still written for clients reading it, until every client uses
+        # the sharded layout and REGISTRY_LAYOUT is set to sharded_only
+        layout = os.environ.get("REGISTRY_LAYOUT", "blob")
+        self._sharded = layout in ("sharded", "sharded_only")
+        self._mirror_single_blob = layout == "sharded"
+        self._projects = {
+            project.strip()
+            for project in os.environ.get("REGISTRY_PROJECTS", "").split(",")
+            if project.strip()
+        } or None
+        # Parsed shards by blob name, shards are content addressed so they never change
+        self._shards: Dict[str, RegistryProto] = {}
+        # Single blob registry read while there is no manifest yet, and its ETag
+        self._single_blob_cached: Optional[Tuple[str, RegistryProto]] = None
+
+        self._cache_path: Optional[str] = None
+        if os.environ.get("REGISTRY_CACHE_DIR"):
+            cache_key = registry_config.path
+            if self._sharded:
+                cache_key += "#" + ",".join(sorted(self._projects or []))
+            self._cache_path = os.path.join(
+                os.environ["REGISTRY_CACHE_DIR"],
+                hashlib.sha256(cache_key.encode()).hexdigest() + ".pb",
+            )
+
+        # With REGISTRY_REFRESH_INTERVAL_SECONDS set, a background thread polls the blob
+        # and swaps in new registry snapshots, which get_registry_proto serves without I/O
+        self._refresh_interval = float(
+            os.environ.get("REGISTRY_REFRESH_INTERVAL_SECONDS", "0")
+        )
+        self._refresher: Optional[threading.Thread] = None
+        self._refresher_lock = threading.Lock()
+
+        # Registry snapshot last returned by get_registry_proto, which the registry
+        # written next is based on. Writes only succeed if the blob still has its ETag
+        self._read: Optional[Tuple[Optional[str], RegistryProto]] = None
+
         try:
             # turn the verbosity of the blob client to warning and above (this reduces verbosity)
             logger = logging.getLogger("azure")
@@ -41,11 +124,11 @@ class AzBlobRegistryStore(RegistryStore):
             # Attempt to use shared account key to login first
             if 'REGISTRY_BLOB_KEY' in os.environ:
                 client = BlobServiceClient(
-                    account_url=self._account_url, credential=os.environ['REGISTRY_BLOB_KEY']
-                )
-                self.blob = client.get_blob_client(
-                    container=self._container, blob=self._path
+                    account_url=self._account_url,
+                    credential=os.environ['REGISTRY_BLOB_KEY'],
+                    **REGISTRY_UPLOAD_BLOCK_SIZES,
                 )
+                self._set_blob_clients(client)
                 return
 
             default_credential = DefaultAzureCredential(
@@ -53,11 +136,11 @@ class AzBlobRegistryStore(RegistryStore):
             )
 
             client = BlobServiceClient(
-                account_url=self._account_url, credential=default_credential
-            )
-            self.blob = client.get_blob_client(
-                container=self._container, blob=self._path
+                account_url=self._account_url,
+                credential=default_credential,
+                **REGISTRY_UPLOAD_BLOCK_SIZES,
             )
+            self._set_blob_clients(client)
         except:
             print(
                 "Could not connect to blob. Check the following\nIs the URL specified correctly?\nIs you IAM role set to Storage Blob Data Contributor?\n"
@@ -65,33 +148,592 @@ class AzBlobRegistryStore(RegistryStore):
 
         return
 
+    def _set_blob_clients(self, client):
+        self.blob = client.get_blob_client(container=self._container, blob=self._path)
+        self._container_client = client.get_container_client(self._container)
+        self.manifest_blob = self._container_client.get_blob_client(
+            f"{self._path}.manifest.json"
+        )
+
     def get_registry_proto(self):
-        file_obj = TemporaryFile()
+        try:
+            return self._get_registry_proto()
+        except FileNotFoundError:
+            # The registry written next creates the blob
+            self._read = None
+            raise
+
+    def _get_registry_proto(self) -> RegistryProto:
+        if self._refresh_interval > 0:
+            # The refresher keeps the snapshot up to date, don't block on blob I/O
+            cached = self._cached
+            if cached is None:
+                self._refresh()
+                cached = self._cached
+            self._start_refresher()
+        else:
+            self._refresh()
+            cached = self._cached
+        self._read = cached
+        return _copy_registry_proto(cached[1])
+
+    def _refresh(self) -> RegistryProto:
+        """
+        Returns the latest registry, which must not be modified, downloading it only
+        if it changed since it was cached.
+        """
+        from azure.core import MatchConditions
+        from azure.core.exceptions import (
+            ResourceNotFoundError,
+            ResourceNotModifiedError,
+        )
+
+        if self._cached is None:
+            self._load_cache_from_disk()
+
+        # Read the ETag and the registry together, as other threads may replace them
+        cached = self._cached
+        if self._sharded:
+            return self._refresh_sharded(cached)
+        try:
+            if cached is None:
+                download_stream = self.blob.download_blob()
+            else:
+                # Only downloads the registry if it changed since it was cached
+                download_stream = self.blob.download_blob(
+                    etag=cached[0], match_condition=MatchConditions.IfModified
+                )
+        except ResourceNotModifiedError:
+            return cached[1]
+        except ResourceNotFoundError:
+            raise self._not_found()
+
+        registry_bytes = download_stream.readall()
         registry_proto = RegistryProto()
+        registry_proto.ParseFromString(registry_bytes)
+        self._cache(download_stream.properties.etag, registry_proto, registry_bytes)
+        return registry_proto
 
-        if self.blob.exists():
-            download_stream = self.blob.download_blob()
-            file_obj.write(download_stream.readall())
+    def _refresh_sharded(
+        self,
+        cached: Optional[Tuple[Optional[str], RegistryProto]],
+        retry_missing_shards: bool = True,
+    ) -> RegistryProto:
+        """
+        Returns the latest registry of the selected projects, downloading the manifest
+        only if it changed since it was cached, and then only the shards not parsed yet.
+        """
+        from azure.core import MatchConditions
+        from azure.core.exceptions import (
+            ResourceNotFoundError,
+            ResourceNotModifiedError,
+        )
 
-            file_obj.seek(0)
-            registry_proto.ParseFromString(file_obj.read())
+        try:
+            if cached is None or cached[0] is None:
+                download_stream = self.manifest_blob.download_blob()
+            else:
+                download_stream = self.manifest_blob.download_blob(
+                    etag=cached[0], match_condition=MatchConditions.IfModified
+                )
+        except ResourceNotModifiedError:
+            return cached[1]
+        except ResourceNotFoundError:
+            # Not written in the sharded layout yet, read the single blob. The registry
+            # written next creates the manifest
+            registry_proto = self._refresh_single_blob()
+            self._cached = (None, registry_proto)
             return registry_proto
-        raise FileNotFoundError(
+
+        manifest = json.loads(download_stream.readall())
+        if manifest.get("format_version") != REGISTRY_MANIFEST_FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported registry manifest format {manifest.get('format_version')} "
+                f"at {self._uri.geturl()}"
+            )
+
+        names = [
+            name
+            for project, name in manifest["shards"].items()
+            if project == "" or self._projects is None or project in self._projects
+        ]
+        shards = {name: self._shards.get(name) for name in names}
+        missing = [name for name, shard in shards.items() if shard is None]
+        if missing:
+            try:
+                with ThreadPoolExecutor(
+                    max_workers=REGISTRY_UPLOAD_MAX_CONCURRENCY
+                ) as executor:
+                    shards.update(
+                        zip(missing, executor.map(self._download_shard, missing))
+                    )
+            except ResourceNotFoundError:
+                if not retry_missing_shards:
+                    raise
+                # A concurrent write replaced the manifest and deleted the shards only
+                # the one we read listed, read the new manifest
+                return self._refresh_sharded(None, retry_missing_shards=False)
+        self._shards = shards
+
+        registry_proto = RegistryProto()
+        for name in names:
+            registry_proto.MergeFrom(shards[name])
+        registry_proto.version_id = manifest["version_id"]
+        registry_proto.last_updated.FromJsonString(manifest["last_updated"])
+        self._cache(
+            download_stream.properties.etag,
+            registry_proto,
+            registry_proto.SerializeToString(),
+        )
+        return registry_proto
+
+    def _refresh_single_blob(self) -> RegistryProto:
+        """
+        Returns the selected projects of the single blob registry, downloading it only
+        if it changed since it was last read.
+        """
+        from azure.core import MatchConditions
+        from azure.core.exceptions import (
+            ResourceNotFoundError,
+            ResourceNotModifiedError,
+        )
+
+        cached = self._single_blob_cached
+        try:
+            if cached is None:
+                download_stream = self.blob.download_blob()
+            else:
+                download_stream = self.blob.download_blob(
+                    etag=cached[0], match_condition=MatchConditions.IfModified
+                )
+        except ResourceNotModifiedError:
+            return cached[1]
+        except ResourceNotFoundError:
+            raise self._not_found()
+
+        registry_proto = RegistryProto()
+        registry_proto.ParseFromString(download_stream.readall())
+        registry_proto = _select_projects(registry_proto, self._projects)
+        self._single_blob_cached = (download_stream.properties.etag, registry_proto)
+        return registry_proto
+
+    def _download_blob_registry(self) -> RegistryProto:
+        from azure.core.exceptions import ResourceNotFoundError
+
+        try:
+            registry_bytes = self.blob.download_blob().readall()
+        except ResourceNotFoundError:
+            raise self._not_found()
+        registry_proto = RegistryProto()
+        registry_proto.ParseFromString(registry_bytes)
+        return registry_proto
+
+    def _download_shard(self, name: str) -> RegistryProto:
+        shard_bytes = self._container_client.get_blob_client(name).download_blob().readall()
+        shard = RegistryProto()
+        shard.ParseFromString(_zstd().ZstdDecompressor().decompress(shard_bytes))
+        return shard
+
+    def _not_found(self) -> FileNotFoundError:
+        return FileNotFoundError(
             f'Registry not found at path "{self._uri.geturl()}". Have you run "feast apply"?'
         )
 
+    def _start_refresher(self):
+        with self._refresher_lock:
+            if self._refresher is not None:
+                return
+            # The thread doesn't keep the store alive, and stops once it's collected
+            self._refresher = threading.Thread(
+                target=_refresh_periodically,
+                args=(weakref.ref(self), self._refresh_interval),
+                daemon=True,
+            )
+            self._refresher.start()
+
     def update_registry_proto(self, registry_proto: RegistryProto):
         self._write_registry(registry_proto)
 
     def teardown(self):
-        self.blob.delete_blob()
+        if not self._sharded:
+            self.blob.delete_blob()
+            return
+
+        from azure.core.exceptions import ResourceNotFoundError
+
+        for blob in self._container_client.list_blobs(
+            name_starts_with=f"{self._path}.shards/"
+        ):
+            self._container_client.delete_blob(blob.name)
+        for blob in (self.manifest_blob, self.blob):
+            try:
+                blob.delete_blob()
+            except ResourceNotFoundError:
+                pass
 
     def _write_registry(self, registry_proto: RegistryProto):
-        registry_proto.version_id = str(uuid.uuid4())
-        registry_proto.last_updated.FromDatetime(datetime.utcnow())
+        """
+        Uploads the registry if the blob hasn't changed since the registry it is based on
+        was read. Otherwise, the changes made since then are merged into the latest
+        registry, by project and name, and the upload is retried. RegistryConflictError
+        is raised if the same object was changed in both. Without a registry read first,
+        e.g. when the blob was missing, every object is taken as added by this write.
+        """
+        from azure.core import MatchConditions
+        from azure.core.exceptions import ResourceExistsError, ResourceModifiedError
 
-        file_obj = TemporaryFile()
-        file_obj.write(registry_proto.SerializeToString())
-        file_obj.seek(0)
-        self.blob.upload_blob(file_obj, overwrite=True)
-        return
+        base_etag, base_proto = self._read or (None, RegistryProto())
+        for attempt in range(REGISTRY_WRITE_ATTEMPTS):
+            registry_proto.version_id = str(uuid.uuid4())
+            registry_proto.last_updated.FromDatetime(datetime.utcnow())
+            registry_bytes = registry_proto.SerializeToString()
+
+            if base_etag is None:
+                # Only creates the blob, it was missing when the registry was read
+                conditions = {"overwrite": False}
+            else:
+                conditions = {
+                    "overwrite": True,
+                    "etag": base_etag,
+                    "match_condition": MatchConditions.IfNotModified,
+                }
+            try:
+                if self._sharded:
+                    etag = self._upload_sharded(registry_proto, conditions)
+                else:
+                    etag = self.blob.upload_blob(
+                        registry_bytes,
+                        max_concurrency=REGISTRY_UPLOAD_MAX_CONCURRENCY,
+                        **conditions,
+                    )["etag"]
+            except (ResourceExistsError, ResourceModifiedError):
+                if attempt == REGISTRY_WRITE_ATTEMPTS - 1:
+                    raise RegistryConflictError(
+                        f"The registry at {self._uri.geturl()} kept changing while it was written"
+                    )
+                # Someone else wrote the registry, merge our changes into theirs
+                self._refresh()
+                latest_etag, latest_proto = self._cached
+                merged_proto = _merge_registry_protos(
+                    base_proto, registry_proto, latest_proto
+                )
+                registry_proto.CopyFrom(merged_proto)
+                base_etag, base_proto = latest_etag, latest_proto
+                continue
+
+            snapshot = (etag, _copy_registry_proto(registry_proto))
+            self._cache(*snapshot, registry_bytes)
+            self._read = snapshot
+            return
+
+    def _upload_sharded(self, registry_proto: RegistryProto, conditions: Dict) -> str:
+        """
+        Uploads the shards of the registry that don't exist yet, then the manifest
+        listing them with the given conditions. Shards of the projects that aren't
+        selected are carried over from the current manifest. Once the manifest is
+        replaced, the shards only the previous one listed are deleted.
+        """
+        shards = _split_registry_proto(registry_proto)
+        previous_shards = self._read_manifest_shards()
+        manifest_shards = {}
+        if self._projects is not None:
+            if previous_shards is None:
+                carried_over = self._upload_single_blob_shards()
+            else:
+                carried_over = previous_shards
+            manifest_shards = {
+                project: name
+                for project, name in carried_over.items()
+                if project not in shards and project not in self._projects
+            }
+
+        uploads = []
+        names = {}
+        for project, shard in shards.items():
+            shard_bytes = shard.SerializeToString(deterministic=True)
+            name = f"{self._path}.shards/{hashlib.sha256(shard_bytes).hexdigest()}.pb.zst"
+            names[project] = name
+            if name not in self._shards:
+                uploads.append((name, shard_bytes))
+        manifest_shards.update(names)
+
+        if uploads:
+            with ThreadPoolExecutor(
+                max_workers=REGISTRY_UPLOAD_MAX_CONCURRENCY
+            ) as executor:
+                list(executor.map(lambda upload: self._upload_shard(*upload), uploads))
+
+        manifest = {
+            "format_version": REGISTRY_MANIFEST_FORMAT_VERSION,
+            "version_id": registry_proto.version_id,
+            "last_updated": registry_proto.last_updated.ToJsonString(),
+            "shards": manifest_shards,
+        }
+        properties = self.manifest_blob.upload_blob(
+            json.dumps(manifest, sort_keys=True), **conditions
+        )
+        self._shards = {names[project]: shard for project, shard in shards.items()}
+
+        if self._mirror_single_blob:
+            self._upload_single_blob(registry_proto, manifest_shards, shards)
+        self._delete_unlisted_shards(previous_shards or {}, manifest_shards)
+        return properties["etag"]
+
+    def _upload_single_blob(
+        self,
+        registry_proto: RegistryProto,
+        manifest_shards: Dict[str, str],
+        shards: Dict[str, RegistryProto],
+    ):
+        """Writes the whole registry to the single blob, for clients reading it"""
+        full_registry_proto = _copy_registry_proto(registry_proto)
+        for project, name in manifest_shards.items():
+            if project not in shards:
+                full_registry_proto.MergeFrom(self._download_shard(name))
+        self.blob.upload_blob(
+            full_registry_proto.SerializeToString(),
+            overwrite=True,
+            max_concurrency=REGISTRY_UPLOAD_MAX_CONCURRENCY,
+        )
+
+    def _delete_unlisted_shards(
+        self, previous_shards: Dict[str, str], manifest_shards: Dict[str, str]
+    ):
+        """
+        Deletes the shards the new manifest doesn't list. Those the replaced manifest
+        listed are deleted right away: the manifest was only replaced if it was the one
+        previous_shards were read from, so no other manifest lists them. Shards left by
+        writes that failed after uploading them are deleted once they are older than
+        REGISTRY_ORPHANED_SHARD_GRACE_SECONDS. Shards are content addressed, so a write
+        in progress may have uploaded the same ones and list them next.
+        """
+        listed = set(manifest_shards.values())
+        cutoff = datetime.now(timezone.utc) - timedelta(
+            seconds=REGISTRY_ORPHANED_SHARD_GRACE_SECONDS
+        )
+        names = {name for name in previous_shards.values() if name not in listed}
+        names.update(
+            blob.name
+            for blob in self._container_client.list_blobs(
+                name_starts_with=f"{self._path}.shards/"
+            )
+            if blob.name not in listed and blob.last_modified < cutoff
+        )
+        self._delete_shards(names)
+
+    def _delete_shards(self, names):
+        from azure.core.exceptions import ResourceNotFoundError
+
+        for name in names:
+            try:
+                self._container_client.delete_blob(name)
+            except ResourceNotFoundError:
+                pass
+
+    def _upload_shard(self, name: str, shard_bytes: bytes):
+        compressor = _zstd().ZstdCompressor(level=REGISTRY_SHARD_COMPRESSION_LEVEL)
+        # Shards are content addressed, an existing blob already has the same content
+        self._container_client.get_blob_client(name).upload_blob(
+            compressor.compress(shard_bytes), overwrite=True
+        )
+
+    def _read_manifest_shards(self) -> Optional[Dict[str, str]]:
+        """Returns the shards listed by the current manifest, None if there is none"""
+        from azure.core.exceptions import ResourceNotFoundError
+
+        try:
+            return json.loads(self.manifest_blob.download_blob().readall())["shards"]
+        except ResourceNotFoundError:
+            return None
+
+    def _upload_single_blob_shards(self) -> Dict[str, str]:
+        """
+        Shards and uploads the single blob registry, so that writing the selected
+        projects while there is no manifest yet doesn't lose the others.
+        """
+        try:
+            registry_proto = self._download_blob_registry()
+        except FileNotFoundError:
+            return {}
+
+        names = {}
+        for project, shard in _split_registry_proto(registry_proto).items():
+            shard_bytes = shard.SerializeToString(deterministic=True)
+            name = f"{self._path}.shards/{hashlib.sha256(shard_bytes).hexdigest()}.pb.zst"
+            self._upload_shard(name, shard_bytes)
+            names[project] = name
+        return names
+
+    def _cache(self, etag: str, registry_proto: RegistryProto, registry_bytes: bytes):
+        self._cached = (etag, registry_proto)
+
+        if self._cache_path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self._cache_path), exist_ok=True)
+            # Write to a temporary file first so that readers never see a partial registry
+            temp_path = f"{self._cache_path}.{uuid.uuid4().hex}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(
+                    b"%s\n%d\n" % (etag.encode(), len(registry_bytes)) + registry_bytes
+                )
+            os.replace(temp_path, self._cache_path)
+        except OSError:
+            # The cache is only an optimization
+            pass
+
+    def _load_cache_from_disk(self):
+        if self._cache_path is None:
+            return
+        from google.protobuf.message import DecodeError
+
+        try:
+            with open(self._cache_path, "rb") as f:
+                etag, length, registry_bytes = f.read().split(b"\n", 2)
+            # A registry cut at a field boundary would still parse
+            if len(registry_bytes) != int(length):
+                raise ValueError("Truncated registry cache")
+            registry_proto = RegistryProto()
+            registry_proto.ParseFromString(registry_bytes)
+        except OSError:
+            return
+        except (ValueError, DecodeError):
+            # Corrupt, discard it so that the registry is downloaded again
+            try:
+                os.remove(self._cache_path)
+            except OSError:
+                pass
+            return
+        self._cached = (etag.decode(), registry_proto)
+
+
+def _copy_registry_proto(registry_proto: RegistryProto) -> RegistryProto:
+    # Callers modify the registry proto they get, so they never get the cached one
+    registry_proto_copy = RegistryProto()
+    registry_proto_copy.CopyFrom(registry_proto)
+    return registry_proto_copy
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError(
+            f"{e}\nThe sharded registry layout needs zstandard, you may need to run "
+            "pip install 'feast-azure-provider[zstd]'"
+        )
+    return zstandard
+
+
+def _project_of(obj) -> str:
+    return getattr(getattr(obj, "spec", obj), "project", "")
+
+
+def _split_registry_proto(registry_proto: RegistryProto) -> Dict[str, RegistryProto]:
+    """
+    Splits a registry into one shard per project, plus a shard keyed by "" holding
+    everything that doesn't belong to a project. Versions are kept in the manifest, so
+    that shards of unchanged projects keep their content.
+    """
+    shared = RegistryProto()
+    shared.CopyFrom(registry_proto)
+    shared.ClearField("version_id")
+    shared.ClearField("last_updated")
+    shards = {"": shared}
+    for field in RegistryProto.DESCRIPTOR.fields:
+        if field.label != field.LABEL_REPEATED:
+            continue
+        shared.ClearField(field.name)
+        for obj in getattr(registry_proto, field.name):
+            shard = shards.setdefault(_project_of(obj), RegistryProto())
+            getattr(shard, field.name).add().CopyFrom(obj)
+    return shards
+
+
+def _select_projects(
+    registry_proto: RegistryProto, projects: Optional[set]
+) -> RegistryProto:
+    if projects is None:
+        return registry_proto
+    for field in RegistryProto.DESCRIPTOR.fields:
+        if field.label != field.LABEL_REPEATED:
+            continue
+        objects = [
+            obj
+            for obj in getattr(registry_proto, field.name)
+            if _project_of(obj) in projects or not _project_of(obj)
+        ]
+        registry_proto.ClearField(field.name)
+        getattr(registry_proto, field.name).extend(objects)
+    return registry_proto
+
+
+def _refresh_periodically(store_ref: "weakref.ref[AzBlobRegistryStore]", interval: float):
+    while True:
+        time.sleep(interval)
+        store = store_ref()
+        if store is None:
+            return
+        try:
+            store._refresh()
+        except Exception:
+            # Keep serving the current snapshot, and retry on the next run
+            pass
+        del store
+
+
+def _merge_registry_protos(
+    base: RegistryProto, ours: RegistryProto, theirs: RegistryProto
+) -> RegistryProto:
+    """
+    Three-way merges registries: objects ours added, changed or deleted since base are
+    applied to theirs. Objects are matched by project and name.
+    """
+    merged = RegistryProto()
+    merged.CopyFrom(theirs)
+    for field in RegistryProto.DESCRIPTOR.fields:
+        if field.label != field.LABEL_REPEATED:
+            if field.message_type is not None and not _same_object(
+                getattr(base, field.name), getattr(ours, field.name)
+            ):
+                getattr(merged, field.name).CopyFrom(getattr(ours, field.name))
+            continue
+
+        base_objects = _objects_by_key(getattr(base, field.name))
+        our_objects = _objects_by_key(getattr(ours, field.name))
+        merged_objects = _objects_by_key(getattr(theirs, field.name))
+        for key in {**base_objects, **our_objects}:
+            base_object, our_object = base_objects.get(key), our_objects.get(key)
+            if _same_object(base_object, our_object):
+                continue
+            their_object = merged_objects.get(key)
+            if not _same_object(base_object, their_object) and not _same_object(
+                our_object, their_object
+            ):
+                raise RegistryConflictError(
+                    f"{field.name} {'/'.join(key)} was changed by a concurrent registry write"
+                )
+            if our_object is None:
+                merged_objects.pop(key, None)
+            else:
+                merged_objects[key] = our_object
+
+        merged.ClearField(field.name)
+        getattr(merged, field.name).extend(merged_objects.values())
+    return merged
+
+
+def _objects_by_key(objects) -> Dict[Tuple[str, str], Any]:
+    by_key = {}
+    for obj in objects:
+        spec = getattr(obj, "spec", obj)
+        by_key[(getattr(spec, "project", ""), getattr(spec, "name", ""))] = obj
+    return by_key
+
+
+def _same_object(a, b) -> bool:
+    if a is None or b is None:
+        return a is b
+    return a.SerializeToString(deterministic=True) == b.SerializeToString(
+        deterministic=True
+    )
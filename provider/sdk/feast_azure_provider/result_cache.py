@@ -0,0 +1,115 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import os
+import threading
+import uuid
+from typing import Iterable, Iterator, Optional
+
+import pyarrow
+import pyarrow.ipc
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class ResultCache:
+    """
+    On-disk cache of Arrow tables stored as Arrow IPC files, one per key. Reading an
+    entry marks it as recently used, and the least recently used entries are evicted
+    once the files take more than max_size_bytes.
+    """
+
+    def __init__(self, directory: str, max_size_bytes: int):
+        self.directory = directory
+        self.max_size_bytes = max_size_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, key: str) -> Optional[pyarrow.Table]:
+        path = self._path(key)
+        try:
+            os.utime(path)
+            with pyarrow.memory_map(path) as source:
+                return pyarrow.ipc.open_file(source).read_all()
+        except (FileNotFoundError, pyarrow.ArrowInvalid):
+            return None
+
+    def contains(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def put(self, key: str, table: pyarrow.Table):
+        # Write to a temporary file first so readers never see a partial entry
+        temp_path = os.path.join(self.directory, f".{uuid.uuid4().hex}.tmp")
+        with pyarrow.OSFile(temp_path, "wb") as sink:
+            with pyarrow.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(temp_path, self._path(key))
+        self._evict()
+
+    def put_batches(
+        self, key: str, batches: Iterable[pyarrow.RecordBatch]
+    ) -> Iterator[pyarrow.RecordBatch]:
+        """
+        Yields the batches while writing them to the entry of key, which is only added
+        once every batch has been written. Nothing is cached if there are no batches or
+        they aren't all consumed.
+        """
+        temp_path = os.path.join(self.directory, f".{uuid.uuid4().hex}.tmp")
+        sink = None
+        writer = None
+        try:
+            for batch in batches:
+                if writer is None:
+                    sink = pyarrow.OSFile(temp_path, "wb")
+                    writer = pyarrow.ipc.new_file(sink, batch.schema)
+                writer.write_batch(batch)
+                yield batch
+            if writer is None:
+                return
+            writer.close()
+            sink.close()
+            writer = sink = None
+            os.replace(temp_path, self._path(key))
+            self._evict()
+        finally:
+            if writer is not None:
+                writer.close()
+            if sink is not None:
+                sink.close()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.arrow")
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".arrow"):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            size = sum(entry_size for _, entry_size, _ in entries)
+            for _, entry_size, path in sorted(entries):
+                if size <= self.max_size_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                size -= entry_size
+
+
+def get_result_cache(directory: str, max_size_bytes: int) -> ResultCache:
+    """Returns the process-wide cache of a directory"""
+    with _caches_lock:
+        cache = _caches.get(directory)
+        if cache is None or cache.max_size_bytes != max_size_bytes:
+            cache = ResultCache(directory, max_size_bytes)
+            _caches[directory] = cache
+        return cache
@@ -0,0 +1,76 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import queue
+import threading
+from typing import Iterable, Iterator, List, TypeVar
+
+T = TypeVar("T")
+
+_DONE = object()
+
+
+def read_ahead(iterable: Iterable[T], depth: int) -> Iterator[T]:
+    """
+    Iterates over an iterable on a background thread, buffering up to depth items so
+    that producing the next item overlaps with the caller consuming the current one.
+    Exceptions raised while producing are re-raised in the consuming thread.
+    """
+    return read_ahead_parallel([iterable], depth)
+
+
+def read_ahead_parallel(
+    iterables: List[Iterable[T]], depth: int, ordered: bool = True
+) -> Iterator[T]:
+    """
+    Iterates over every iterable on its own background thread, buffering up to depth
+    items per iterable. If ordered, all the items of the first iterable are yielded
+    before those of the second one and so on, otherwise items are yielded as soon as
+    they are produced. Exceptions raised while producing are re-raised in the
+    consuming thread.
+    """
+    depth = max(depth, 1)
+    if ordered:
+        buffers = [queue.Queue(maxsize=depth) for _ in iterables]
+    else:
+        buffers = [queue.Queue(maxsize=depth * max(len(iterables), 1))] * len(iterables)
+    stopped = threading.Event()
+
+    def put(buffer: queue.Queue, item) -> bool:
+        # Give up once the consumer has gone away instead of blocking forever
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce(iterable: Iterable[T], buffer: queue.Queue):
+        try:
+            for item in iterable:
+                if not put(buffer, (item, None)):
+                    return
+        except BaseException as e:
+            put(buffer, (_DONE, e))
+        else:
+            put(buffer, (_DONE, None))
+
+    for iterable, buffer in zip(iterables, buffers):
+        threading.Thread(target=produce, args=(iterable, buffer), daemon=True).start()
+
+    try:
+        remaining = len(iterables)
+        position = 0
+        while remaining:
+            item, error = buffers[position].get()
+            if error is not None:
+                raise error
+            if item is _DONE:
+                remaining -= 1
+                if ordered:
+                    position += 1
+                continue
+            yield item
+    finally:
+        stopped.set()
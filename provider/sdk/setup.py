@@ -37,7 +37,8 @@ setup(
         "pyodbc>=4.0.30",
     ],
     extras_require={"dev": ["pytest", "mypy", "assertpy"],
-                    "snowflake": ["snowflake-connector-python[pandas]>=2.7.3"]},
+                    "snowflake": ["snowflake-connector-python[pandas]>=2.7.3"],
+                    "zstd": ["zstandard>=0.15.2"]},
     # https://stackoverflow.com/questions/28509965/setuptools-development-requirements
     # Install dev requirements with: pip install -e .[dev]
     include_package_data=True,
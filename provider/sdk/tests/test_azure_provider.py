@@ -0,0 +1,283 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import threading
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pyarrow as pa
+import pytest
+from feast import Field, FileSource
+from feast.feature_view import FeatureView
+from feast.types import Int64
+from feast.value_type import ValueType
+from tqdm import tqdm
+
+from feast_azure_provider.azure_provider import (
+    AzureProvider,
+    AzureProviderConfig,
+    _latest_across_slices,
+    _split_time_range,
+)
+from feast_azure_provider.mssqlserver import MsSqlServerOfflineStoreConfig
+
+START = datetime(2022, 1, 1)
+
+
+@pytest.mark.parametrize("slices", [1, 3, 7])
+def test_time_slices_cover_the_range(slices):
+    end = START + timedelta(days=1)
+
+    time_slices = _split_time_range(START, end, slices)
+
+    assert len(time_slices) == slices
+    assert time_slices[0][0] == START
+    assert time_slices[-1][1] == end
+    for (_, previous_end), (next_start, _) in zip(time_slices, time_slices[1:]):
+        assert previous_end == next_start
+
+
+@pytest.mark.parametrize("slices", [0, -1])
+def test_empty_or_invalid_ranges_are_not_split(slices):
+    assert _split_time_range(START, START, 4) == [(START, START)]
+    end = START + timedelta(days=1)
+    assert _split_time_range(START, end, slices) == [(START, end)]
+
+
+def _batch(driver_ids, values):
+    return pa.RecordBatch.from_arrays(
+        [pa.array(driver_ids, type=pa.int64()), pa.array(values)],
+        names=["driver_id", "value"],
+    )
+
+
+def _rows(batches):
+    return [
+        row
+        for batch in batches
+        for row in zip(*(column.to_pylist() for column in batch.columns))
+    ]
+
+
+def test_latest_rows_across_slices():
+    # Newest slice first, every slice split over several batches
+    batches = [
+        (0, _batch([1, 2], ["newest 1", "newest 2"])),
+        (0, _batch([3], ["newest 3"])),
+        (1, _batch([1, 4], ["older 1", "older 4"])),
+        (1, _batch([2], ["older 2"])),
+        (2, _batch([4, 5, 3], ["oldest 4", "oldest 5", "oldest 3"])),
+    ]
+
+    assert _rows(_latest_across_slices(batches, ["driver_id"])) == [
+        (1, "newest 1"),
+        (2, "newest 2"),
+        (3, "newest 3"),
+        (4, "older 4"),
+        (5, "oldest 5"),
+    ]
+
+
+def test_batches_of_entities_all_seen_are_dropped():
+    batches = [(0, _batch([1, 2], ["newest", "newest"])), (1, _batch([2, 1], ["a", "b"]))]
+
+    assert len(list(_latest_across_slices(batches, ["driver_id"]))) == 1
+
+
+def test_latest_row_across_slices_without_join_keys():
+    batches = [
+        (0, pa.RecordBatch.from_arrays([pa.array(["newest"])], names=["value"])),
+        (1, pa.RecordBatch.from_arrays([pa.array(["older"])], names=["value"])),
+    ]
+
+    assert _rows(_latest_across_slices(batches, [])) == [("newest",)]
+
+
+class FakeRetrievalJob:
+    def __init__(self, *batches):
+        self._batches = batches
+
+    def to_arrow_batches(self, batch_size):
+        yield from self._batches
+
+
+@pytest.mark.parametrize("max_sql_connections", [1, 2, 8])
+def test_slices_are_read_in_order(max_sql_connections):
+    provider = SimpleNamespace(
+        provider_config=AzureProviderConfig(
+            materialization_max_sql_connections=max_sql_connections
+        )
+    )
+    jobs = [
+        FakeRetrievalJob(*(_batch([i], [f"{i}.{j}"]) for j in range(3)))
+        for i in range(5)
+    ]
+
+    read = [
+        (index, batch.column(1)[0].as_py())
+        for index, batch in AzureProvider._read_slices(provider, jobs)
+    ]
+
+    assert read == [(i, f"{i}.{j}") for i in range(5) for j in range(3)]
+
+
+FEATURE_VIEW = FeatureView(
+    name="driver_stats",
+    entities=["driver"],
+    ttl=timedelta(days=1),
+    schema=[Field(name="trips", dtype=Int64)],
+    source=FileSource(path="driver_stats.parquet", timestamp_field="event_timestamp"),
+)
+
+
+def _tables(count: int, pulled: list = None):
+    """Yields count tables of one row, with driver_id and trips both set to their index"""
+    for i in range(count):
+        if pulled is not None:
+            pulled.append(i)
+        yield pa.table(
+            {
+                "driver_id": pa.array([i], type=pa.int64()),
+                "trips": pa.array([i], type=pa.int64()),
+                "event_timestamp": pa.array([START], type=pa.timestamp("us")),
+            }
+        )
+
+
+class FakeOnlineStore:
+    """Records the trips written, writes wait for release and fail if fail_at is written"""
+
+    def __init__(self, fail_at: int = None):
+        self.written = []
+        self.release = threading.Event()
+        self.release.set()
+        self.fail_at = fail_at
+        self.concurrent_writes = 0
+        self.max_concurrent_writes = 0
+        self._lock = threading.Lock()
+
+    def online_write_batch(self, config, table, data, progress):
+        with self._lock:
+            self.concurrent_writes += 1
+            self.max_concurrent_writes = max(
+                self.max_concurrent_writes, self.concurrent_writes
+            )
+        try:
+            self.release.wait()
+            for _, values, _, _ in data:
+                trips = values["trips"].int64_val
+                if trips == self.fail_at:
+                    raise RuntimeError(f"Could not write {trips}")
+                with self._lock:
+                    self.written.append(trips)
+            if progress:
+                progress(len(data))
+        finally:
+            with self._lock:
+                self.concurrent_writes -= 1
+
+
+def _provider(online_store, **settings):
+    provider = AzureProvider(
+        SimpleNamespace(
+            azure_provider=settings,
+            offline_store=MsSqlServerOfflineStoreConfig(),
+            online_store=None,
+        )
+    )
+    provider.online_store = online_store
+    return provider
+
+
+def _write(provider, tables):
+    with tqdm(total=0, disable=True) as pbar:
+        provider._write_tables_to_online_store(
+            FEATURE_VIEW, {"driver_id": ValueType.INT64}, tables, pbar
+        )
+        return pbar.total
+
+
+def test_provider_reads_the_materialization_settings_of_its_config():
+    provider = _provider(
+        None,
+        materialization_queue_depth=0,
+        materialization_write_concurrency=3,
+        materialization_conversion_processes=2,
+    )
+
+    assert provider.provider_config.materialization_queue_depth == 0
+    assert provider.provider_config.materialization_write_concurrency == 3
+    assert provider.provider_config.materialization_conversion_processes == 2
+
+
+@pytest.mark.parametrize(
+    "settings",
+    [
+        {"materialization_queue_depth": 0},
+        {"materialization_queue_depth": 2},
+        {"materialization_queue_depth": 2, "materialization_conversion_processes": 1},
+    ],
+)
+def test_tables_are_written_in_order(settings):
+    online_store = FakeOnlineStore()
+
+    assert _write(_provider(online_store, **settings), _tables(20)) == 20
+    assert online_store.written == list(range(20))
+
+
+@pytest.mark.parametrize("depth", [1, 3])
+def test_tables_in_flight_are_bounded_by_the_queue_depth(depth):
+    online_store = FakeOnlineStore()
+    online_store.release.clear()
+    pulled = []
+    provider = _provider(online_store, materialization_queue_depth=depth)
+    writer = threading.Thread(target=_write, args=(provider, _tables(50, pulled)))
+    writer.start()
+    # Wait for the pipeline to fill up while the first write is blocked
+    while True:
+        count = len(pulled)
+        time.sleep(0.5)
+        if len(pulled) == count:
+            break
+
+    # Tables being written or waiting to be, read ahead, and one waiting to be queued
+    assert len(pulled) == 2 * depth + 2
+    online_store.release.set()
+    writer.join()
+    assert online_store.written == list(range(50))
+
+
+def test_writes_are_spread_over_the_write_concurrency():
+    online_store = FakeOnlineStore()
+    online_store.release.clear()
+    provider = _provider(
+        online_store,
+        materialization_queue_depth=4,
+        materialization_write_concurrency=3,
+    )
+    writer = threading.Thread(target=_write, args=(provider, _tables(10)))
+    writer.start()
+    while online_store.concurrent_writes < 3:
+        time.sleep(0.01)
+    time.sleep(0.2)
+
+    assert online_store.max_concurrent_writes == 3
+    online_store.release.set()
+    writer.join()
+    assert sorted(online_store.written) == list(range(10))
+
+
+@pytest.mark.parametrize("depth", [0, 2])
+def test_write_errors_are_raised(depth):
+    online_store = FakeOnlineStore(fail_at=3)
+    pulled = []
+
+    with pytest.raises(RuntimeError, match="Could not write 3"):
+        _write(
+            _provider(online_store, materialization_queue_depth=depth),
+            _tables(100, pulled),
+        )
+
+    # The pipeline stops instead of reading the rest of the tables
+    assert len(pulled) < 100
@@ -0,0 +1,218 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+"""
+Benchmarks of the provider against the code paths they replace. They are deselected
+by default, run them with: pytest -m slow -s tests/test_benchmarks.py
+"""
+
+import itertools
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+import pandas
+import pyarrow as pa
+import pytest
+import sqlalchemy
+from feast import Field, FileSource
+from feast.feature_view import FeatureView
+from feast.infra.provider import _convert_arrow_to_proto
+from feast.types import Float64, Int64, String, UnixTimestamp
+from feast.value_type import ValueType
+from tqdm import tqdm
+
+from feast_azure_provider.azure_provider import AzureProvider
+from feast_azure_provider.mssqlserver import (
+    MsSqlServerOfflineStoreConfig,
+    _upload_entity_df,
+)
+from feast_azure_provider.proto_conversion import convert_arrow_to_proto
+
+pytestmark = pytest.mark.slow
+
+
+def _best_of(repeat: int, function) -> float:
+    """Returns the shortest wall-clock time of repeat calls of function, in seconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def _report(name: str, rows: int, timings: dict):
+    print(f"\n{name}, {rows} rows")
+    baseline = next(iter(timings.values()))
+    for label, seconds in timings.items():
+        print(
+            f"  {label:<24}{seconds:8.3f}s{rows / seconds:12,.0f} rows/s"
+            f"{baseline / seconds:8.1f}x"
+        )
+
+
+def _driver_stats(rows: int):
+    """Returns a table of driver statistics and its feature view"""
+    rng = np.random.default_rng(42)
+    start = datetime(2022, 1, 1)
+    timestamps = pa.array(
+        [start + timedelta(seconds=int(s)) for s in rng.integers(0, 86400, rows)],
+        type=pa.timestamp("us"),
+    )
+    table = pa.table(
+        {
+            "driver_id": pa.array(np.arange(rows), type=pa.int64()),
+            "trips": pa.array(rng.integers(0, 1000, rows), type=pa.int64()),
+            "conv_rate": pa.array(rng.random(rows), type=pa.float64()),
+            "name": pa.array([f"driver {i}" for i in range(rows)], type=pa.string()),
+            "last_trip": timestamps,
+            "event_timestamp": timestamps,
+            "created": timestamps,
+        }
+    )
+    feature_view = FeatureView(
+        name="driver_stats",
+        entities=["driver"],
+        ttl=timedelta(days=1),
+        schema=[
+            Field(name="trips", dtype=Int64),
+            Field(name="conv_rate", dtype=Float64),
+            Field(name="name", dtype=String),
+            Field(name="last_trip", dtype=UnixTimestamp),
+        ],
+        source=FileSource(
+            path="driver_stats.parquet",
+            timestamp_field="event_timestamp",
+            created_timestamp_column="created",
+        ),
+    )
+    return table, feature_view
+
+
+def test_proto_conversion_against_feast():
+    rows = 100_000
+    table, feature_view = _driver_stats(rows)
+    join_keys = {"driver_id": ValueType.INT64}
+
+    assert convert_arrow_to_proto(
+        table.slice(0, 1000), feature_view, join_keys
+    ) == _convert_arrow_to_proto(table.slice(0, 1000), feature_view, join_keys)
+
+    _report(
+        "Arrow to proto conversion",
+        rows,
+        {
+            "feast, per row": _best_of(
+                3, lambda: _convert_arrow_to_proto(table, feature_view, join_keys)
+            ),
+            "column-wise": _best_of(
+                3, lambda: convert_arrow_to_proto(table, feature_view, join_keys)
+            ),
+        },
+    )
+
+
+def test_entity_upload_against_row_at_a_time_inserts(tmp_path):
+    # SQLite stands in for SQL Server. It has no network round trip per statement,
+    # so the gains against row at a time inserts are a lower bound
+    rows = 200_000
+    rng = np.random.default_rng(42)
+    entity_df = pandas.DataFrame(
+        {
+            "driver_id": rng.integers(0, 10_000, rows),
+            "event_timestamp": pandas.Timestamp("2022-01-01")
+            + pandas.to_timedelta(rng.integers(0, 86400, rows), unit="s"),
+        }
+    )
+    config = MsSqlServerOfflineStoreConfig()
+    uploads = itertools.count()
+
+    def upload(fast_executemany: bool = None, row_at_a_time: bool = False):
+        engine = sqlalchemy.create_engine(
+            f"sqlite:///{tmp_path / f'entities_{next(uploads)}.db'}"
+        )
+        if row_at_a_time:
+            # What DataFrame.to_sql does through pyodbc without fast_executemany
+            entity_df.to_sql(name="entity_df", con=engine, index=False, chunksize=1)
+        else:
+            engine.dialect.fast_executemany = fast_executemany
+            _upload_entity_df(engine, config, entity_df, "entity_df")
+        with engine.connect() as connection:
+            assert connection.execute(
+                sqlalchemy.text("SELECT COUNT(*) FROM entity_df")
+            ).scalar() == rows
+        engine.dispose()
+
+    _report(
+        "Entity dataframe upload to SQLite",
+        rows,
+        {
+            "row at a time": _best_of(1, lambda: upload(row_at_a_time=True)),
+            "multi-row INSERTs": _best_of(3, lambda: upload(fast_executemany=False)),
+            "executemany chunks": _best_of(3, lambda: upload(fast_executemany=True)),
+        },
+    )
+
+
+class _SlowOnlineStore:
+    """Stands in for a remote online store, with a fixed latency per write"""
+
+    def __init__(self, latency_seconds: float):
+        self._latency_seconds = latency_seconds
+        self.rows = 0
+
+    def online_write_batch(self, config, table, data, progress):
+        time.sleep(self._latency_seconds)
+        self.rows += len(data)
+
+
+def test_materialization_pipeline_against_serial_writes():
+    rows, batch_size = 200_000, 2_000
+    table, feature_view = _driver_stats(rows)
+    join_keys = {"driver_id": ValueType.INT64}
+
+    def materialize(**settings):
+        provider = AzureProvider(
+            SimpleNamespace(
+                azure_provider=settings,
+                offline_store=MsSqlServerOfflineStoreConfig(),
+                online_store=None,
+            )
+        )
+        online_store = provider.online_store = _SlowOnlineStore(latency_seconds=0.02)
+        with tqdm(total=0, disable=True) as pbar:
+            provider._write_tables_to_online_store(
+                feature_view,
+                join_keys,
+                (pa.Table.from_batches([b]) for b in table.to_batches(batch_size)),
+                pbar,
+            )
+        assert online_store.rows == rows
+
+    _report(
+        "Materialization of 100 batches, 20ms per online store write",
+        rows,
+        {
+            "serial": _best_of(1, lambda: materialize(materialization_queue_depth=0)),
+            "pipelined": _best_of(
+                1, lambda: materialize(materialization_queue_depth=4)
+            ),
+            "4 writers": _best_of(
+                1,
+                lambda: materialize(
+                    materialization_queue_depth=4,
+                    materialization_write_concurrency=4,
+                ),
+            ),
+            "4 writers, 2 processes": _best_of(
+                1,
+                lambda: materialize(
+                    materialization_queue_depth=4,
+                    materialization_write_concurrency=4,
+                    materialization_conversion_processes=2,
+                ),
+            ),
+        },
+    )
@@ -0,0 +1,29 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import subprocess
+import sys
+
+import pytest
+
+
+@pytest.mark.parametrize(
+    "module",
+    [
+        "feast_azure_provider.azure_provider",
+        "feast_azure_provider.mssqlserver",
+        "feast_azure_provider.mssqlserver_source",
+        "feast_azure_provider.registry_store",
+    ],
+)
+def test_importing_the_provider_does_not_import_sqlalchemy(module):
+    # SQLAlchemy is only needed once the offline store or a source queries SQL Server
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            f"import sys, {module}; assert 'sqlalchemy' not in sys.modules, "
+            "sorted(m for m in sys.modules if m.startswith('sqlalchemy'))[:5]",
+        ],
+        check=True,
+    )
@@ -0,0 +1,579 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import random
+import re
+import sqlite3
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+
+import pandas
+import pyarrow
+import pytest
+import sqlalchemy
+from feast.protos.feast.core.Registry_pb2 import Registry as RegistryProto
+
+from feast_azure_provider.azure_provider import AzureProvider
+from feast_azure_provider.mssqlserver import (
+    ENTITY_ROW_ID_COLUMN,
+    FeatureViewQueryContext,
+    MsSqlServerOfflineStore,
+    MsSqlServerOfflineStoreConfig,
+    MsSqlServerRetrievalJob,
+    _build_point_in_time_queries,
+    _get_result_cache_key,
+    _pyodbc_values_to_arrow,
+    _upload_entity_df,
+)
+from feast_azure_provider.mssqlserver_entity_tables import (
+    EntityTableLease,
+    StagedEntityTables,
+)
+from feast_azure_provider.result_cache import ResultCache
+
+
+def test_decimals_are_read_as_doubles_whatever_their_precision():
+    first = _pyodbc_values_to_arrow([Decimal("1.5"), None], Decimal)
+    second = _pyodbc_values_to_arrow([Decimal("1234567.125")], Decimal)
+
+    assert first.type == second.type == pyarrow.float64()
+    assert first.to_pylist() == [1.5, None]
+    assert second.to_pylist() == [1234567.125]
+
+
+def test_all_null_batches_keep_the_column_type():
+    for type_code in (bool, int, float, str, bytes, date, datetime, Decimal):
+        assert _pyodbc_values_to_arrow([None, None], type_code).type != pyarrow.null()
+
+
+def test_datetimes_are_read_as_utc():
+    naive = _pyodbc_values_to_arrow([datetime(2022, 1, 1, 12)], datetime)
+    aware = _pyodbc_values_to_arrow(
+        [datetime(2022, 1, 1, 12, tzinfo=timezone.utc)], datetime
+    )
+
+    assert naive.type == aware.type == pyarrow.timestamp("us", tz="UTC")
+    assert naive.equals(aware)
+
+
+def test_unknown_types_are_read_as_strings():
+    value = uuid.uuid4()
+    array = _pyodbc_values_to_arrow([value, None], uuid.UUID)
+
+    assert array.type == pyarrow.string()
+    assert array.to_pylist() == [str(value), None]
+
+
+class _FakeCursor:
+    def __init__(self, description, rows):
+        self.description = description
+        self.messages = []
+        self._rows = rows
+
+    def execute(self, query):
+        pass
+
+    def fetchmany(self, size):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def close(self):
+        pass
+
+
+class _FakeEngine:
+    def __init__(self, description, rows):
+        self._cursor = _FakeCursor(description, rows)
+
+    def raw_connection(self):
+        return self
+
+    def cursor(self):
+        return self._cursor
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _fetch_table(description, rows, batch_size):
+    job = MsSqlServerRetrievalJob(
+        query="SELECT",
+        engine=_FakeEngine(description, rows),
+        config=MsSqlServerOfflineStoreConfig(),
+        full_feature_names=False,
+        on_demand_feature_views=None,
+    )
+    return pyarrow.Table.from_batches(list(job._fetch_arrow_batches(batch_size)))
+
+
+def test_entity_tables_are_released_once_the_result_is_read(tmp_path):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'entities.db'}")
+    tables = StagedEntityTables(engine)
+    entity_df = pandas.DataFrame({"driver_id": [1, 2]})
+    lease = EntityTableLease(tables, tables.table_name(entity_df))
+    uploads = []
+
+    def upload(table_id: str):
+        uploads.append(table_id)
+        entity_df.to_sql(name=table_id, con=engine, index=False)
+
+    lease.acquire(upload)
+    job = MsSqlServerRetrievalJob(
+        query="SELECT",
+        engine=_FakeEngine([("driver_id", int)], [(1,), (2,)]),
+        config=MsSqlServerOfflineStoreConfig(),
+        full_feature_names=False,
+        on_demand_feature_views=None,
+        entity_table=lease,
+    )
+
+    batches = job.to_arrow_batches(1)
+    next(batches)
+    assert sqlalchemy.inspect(engine).has_table(lease.table_name)
+    list(batches)
+    assert not sqlalchemy.inspect(engine).has_table(lease.table_name)
+
+    # Reading the result again stages the entity table again
+    job.to_arrow()
+    assert uploads == [lease.table_name] * 2
+    assert not sqlalchemy.inspect(engine).has_table(lease.table_name)
+
+
+def test_closed_jobs_release_their_entity_table(tmp_path):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'entities.db'}")
+    tables = StagedEntityTables(engine)
+    lease = EntityTableLease(tables, tables.table_name())
+    lease.acquire(
+        lambda table_id: pandas.DataFrame({"driver_id": [1]}).to_sql(
+            name=table_id, con=engine, index=False
+        )
+    )
+    job = MsSqlServerRetrievalJob(
+        query="SELECT",
+        engine=_FakeEngine([("driver_id", int)], []),
+        config=MsSqlServerOfflineStoreConfig(),
+        full_feature_names=False,
+        on_demand_feature_views=None,
+        entity_table=lease,
+    )
+
+    job.close()
+
+    assert not sqlalchemy.inspect(engine).has_table(lease.table_name)
+
+
+def test_streamed_results_are_cached(tmp_path):
+    result_cache = ResultCache(str(tmp_path), max_size_bytes=1 << 30)
+    job = MsSqlServerRetrievalJob(
+        query="SELECT",
+        engine=_FakeEngine([("driver_id", int)], [(1,), (2,)]),
+        config=MsSqlServerOfflineStoreConfig(),
+        full_feature_names=False,
+        on_demand_feature_views=None,
+        result_cache=result_cache,
+        result_cache_key="key",
+    )
+
+    assert sum(batch.num_rows for batch in job.to_arrow_batches(1)) == 2
+
+    # The cursor has no rows left, so they can only come from the cache
+    assert result_cache.contains("key")
+    assert job.to_arrow().column("driver_id").to_pylist() == [1, 2]
+
+
+def test_datetimeoffset_columns_described_as_strings_are_read_as_timestamps():
+    # SQLAlchemy converts DATETIMEOFFSET values to datetimes, pyodbc describes them as str
+    timestamp = datetime(2022, 1, 1, 12, tzinfo=timezone(timedelta(hours=2)))
+    table = _fetch_table(
+        [("event_timestamp", str), ("driver_id", str)],
+        [(timestamp, "a"), (None, "b"), (timestamp, None)],
+        batch_size=2,
+    )
+
+    assert table.schema.field("event_timestamp").type == pyarrow.timestamp(
+        "us", tz="UTC"
+    )
+    assert table.schema.field("driver_id").type == pyarrow.string()
+    assert table.column("event_timestamp").to_pylist() == [
+        timestamp,
+        None,
+        timestamp,
+    ]
+
+
+def test_datetimes_after_a_null_first_batch_of_a_string_column_are_read_as_strings():
+    timestamp = datetime(2022, 1, 1, 12, tzinfo=timezone.utc)
+    table = _fetch_table(
+        [("event_timestamp", str)], [(None,), (timestamp,)], batch_size=1
+    )
+
+    assert table.schema.field("event_timestamp").type == pyarrow.string()
+    assert table.column("event_timestamp").to_pylist() == [None, str(timestamp)]
+
+
+def _record_inserts(engine):
+    """Returns the number of rows of every INSERT statement and executemany call"""
+    inserts = []
+
+    @sqlalchemy.event.listens_for(engine, "before_cursor_execute")
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("INSERT"):
+            inserts.append(
+                len(parameters) if executemany else statement.count("(?") or 1
+            )
+
+    return inserts
+
+
+@pytest.mark.parametrize(
+    "fast_executemany, expected_inserts",
+    # Multi-row INSERTs are capped to 2099 parameters, 699 rows of 3 columns
+    [(True, [1000, 1000, 500]), (False, [699] * 3 + [403])],
+)
+def test_entity_upload_chunksize_and_fast_executemany_are_used(
+    tmp_path, fast_executemany, expected_inserts
+):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'entities.db'}")
+    engine.dialect.fast_executemany = fast_executemany
+    inserts = _record_inserts(engine)
+    entity_df = pandas.DataFrame(
+        {"driver_id": range(2500), "event_timestamp": [datetime(2022, 1, 1)] * 2500}
+    )
+
+    _upload_entity_df(
+        engine,
+        MsSqlServerOfflineStoreConfig(entity_upload_chunksize=1000),
+        entity_df,
+        "entity_df",
+    )
+
+    assert inserts == expected_inserts
+    with engine.connect() as connection:
+        row_ids = connection.execute(
+            sqlalchemy.text(f"SELECT {ENTITY_ROW_ID_COLUMN} FROM entity_df")
+        ).fetchall()
+    assert sorted(row_id for row_id, in row_ids) == list(range(1, 2501))
+
+
+def test_empty_entity_dataframes_are_rejected():
+    with pytest.raises(ValueError, match="no rows"):
+        MsSqlServerOfflineStore().get_historical_features(
+            config=None,
+            feature_views=[],
+            feature_refs=[],
+            entity_df=pandas.DataFrame({"driver_id": [], "event_timestamp": []}),
+            registry=None,
+            project="project",
+        )
+
+
+def _to_sqlite(query: str) -> str:
+    """Translates the T-SQL the point-in-time templates use into SQLite"""
+    query = re.sub(r"CONVERT\(DATETIMEOFFSET, ('[^']*'), 120\)", r"\1", query)
+    query = re.sub(
+        r"DATEDIFF\(SECOND, ([\w.]+), ([\w.]+)\)",
+        r"(strftime('%s', \2) - strftime('%s', \1))",
+        query,
+    )
+    return query.replace("> =", ">=")
+
+
+def _run_on_sqlite(connection, staging_queries, query, cleanup_queries):
+    """Runs the statements of the temp table mode, staging #temp tables as TEMP tables"""
+    for staging_query in staging_queries:
+        for statement in _to_sqlite(staging_query).split(";"):
+            into = re.search(r"INTO #(\w+)", statement)
+            if into is None:
+                # Indexes don't change the result
+                continue
+            statement = statement.replace(into.group(0), "").replace("#", "")
+            connection.execute(f"CREATE TEMP TABLE {into.group(1)} AS {statement}")
+    rows = list(connection.execute(_to_sqlite(query).replace("#", "")))
+    for cleanup_query in cleanup_queries:
+        connection.execute(cleanup_query.replace("#", ""))
+    return rows
+
+
+@pytest.mark.parametrize("created_timestamp_column", ["created", ""])
+def test_point_in_time_join_strategies_and_modes_return_the_same_rows(
+    created_timestamp_column,
+):
+    rng = random.Random(42)
+    start = datetime(2022, 1, 1)
+
+    def timestamp(minutes: int) -> str:
+        return str(start + timedelta(minutes=minutes))
+
+    # Event timestamps are only unique per driver without a created timestamp column,
+    # otherwise rows are rewritten later with the same event timestamp
+    feature_rows = []
+    for driver_id in range(5):
+        minutes = rng.sample(range(200), 10)
+        if created_timestamp_column:
+            minutes += rng.sample(minutes, 5)
+        for i, event_minutes in enumerate(minutes):
+            created = str(start + timedelta(minutes=event_minutes, seconds=i))
+            feature_rows.append(
+                (driver_id, timestamp(event_minutes), created, rng.random())
+            )
+    entity_rows = [
+        (rng.randrange(6), timestamp(rng.randrange(250)), row_id)
+        for row_id in range(1, 41)
+    ]
+    ttl_seconds = 60 * 60
+
+    connection = sqlite3.connect(":memory:")
+    connection.execute(
+        "CREATE TABLE driver_stats (driver_id, event_timestamp, created, conv_rate)"
+    )
+    connection.executemany("INSERT INTO driver_stats VALUES (?, ?, ?, ?)", feature_rows)
+    connection.execute(
+        f"CREATE TABLE entity_df (driver_id, event_timestamp, {ENTITY_ROW_ID_COLUMN})"
+    )
+    connection.executemany("INSERT INTO entity_df VALUES (?, ?, ?)", entity_rows)
+
+    context = FeatureViewQueryContext(
+        name="driver_stats",
+        ttl=ttl_seconds,
+        entities=["driver_id"],
+        features=["conv_rate"],
+        table_ref="driver_stats",
+        event_timestamp_column="event_timestamp",
+        created_timestamp_column=created_timestamp_column,
+        table_subquery="driver_stats",
+        entity_selections=["driver_id AS driver_id"],
+        entity_columns=["driver_id"],
+        min_event_timestamp=timestamp(-60),
+        max_event_timestamp=timestamp(250),
+    )
+
+    results = {}
+    for mode in ("cte", "temp_tables"):
+        for strategy in ("max_self_join", "row_number"):
+            queries = _build_point_in_time_queries(
+                mode,
+                [context],
+                min_timestamp=start,
+                max_timestamp=start + timedelta(minutes=250),
+                left_table_query_string="entity_df",
+                entity_df_event_timestamp_col="event_timestamp",
+                point_in_time_join_strategy=strategy,
+            )
+            results[mode, strategy] = sorted(
+                (row_id, conv_rate)
+                for _, _, row_id, _, conv_rate in _run_on_sqlite(connection, *queries)
+            )
+
+    expected = []
+    for driver_id, entity_timestamp, row_id in entity_rows:
+        candidates = [
+            (event_timestamp, created, conv_rate)
+            for feature_driver_id, event_timestamp, created, conv_rate in feature_rows
+            if feature_driver_id == driver_id
+            and event_timestamp <= entity_timestamp
+            and datetime.fromisoformat(entity_timestamp)
+            - datetime.fromisoformat(event_timestamp)
+            <= timedelta(seconds=ttl_seconds)
+        ]
+        expected.append((row_id, max(candidates)[2] if candidates else None))
+
+    assert all(result == sorted(expected) for result in results.values())
+
+
+@pytest.mark.parametrize(
+    "point_in_time_join_strategy, created_timestamp_column, stages",
+    [
+        ("max_self_join", "created", ["subquery", "base", "dedup", "latest", "cleaned"]),
+        ("max_self_join", "", ["subquery", "base", "latest", "cleaned"]),
+        ("row_number", "created", ["subquery", "base", "cleaned"]),
+    ],
+)
+def test_temp_table_mode_stages_and_indexes_every_stage(
+    point_in_time_join_strategy, created_timestamp_column, stages
+):
+    context = FeatureViewQueryContext(
+        name="driver_stats",
+        ttl=3600,
+        entities=["driver_id"],
+        features=["conv_rate"],
+        table_ref="driver_stats",
+        event_timestamp_column="event_timestamp",
+        created_timestamp_column=created_timestamp_column,
+        table_subquery="driver_stats",
+        entity_selections=["driver_id AS driver_id"],
+        entity_columns=["driver_id"],
+        min_event_timestamp="2022-01-01 00:00:00",
+        max_event_timestamp="2022-01-02 00:00:00",
+    )
+
+    staging_queries, query, cleanup_queries = _build_point_in_time_queries(
+        "temp_tables",
+        [context],
+        min_timestamp=datetime(2022, 1, 1),
+        max_timestamp=datetime(2022, 1, 2),
+        left_table_query_string="entity_df",
+        entity_df_event_timestamp_col="event_timestamp",
+        point_in_time_join_strategy=point_in_time_join_strategy,
+    )
+
+    tables = ["#entity_dataframe"] + [f"#driver_stats__{stage}" for stage in stages]
+    assert len(staging_queries) == len(tables)
+    for table, staging_query in zip(tables, staging_queries):
+        assert re.search(rf"INTO {table}\s", staging_query)
+        assert f"CREATE CLUSTERED INDEX ix ON {table} (" in staging_query
+        # Stages only read tables staged before them, never CTEs
+        assert "WITH" not in staging_query
+    assert "#driver_stats__cleaned" in query
+    assert cleanup_queries == [f"DROP TABLE IF EXISTS {table}" for table in tables]
+
+
+@pytest.mark.parametrize("point_in_time_join_mode", ["cte", "temp_tables"])
+def test_provider_passes_the_point_in_time_join_mode_to_the_query(
+    point_in_time_join_mode,
+):
+    context = FeatureViewQueryContext(
+        name="driver_stats",
+        ttl=3600,
+        entities=["driver_id"],
+        features=["conv_rate"],
+        table_ref="driver_stats",
+        event_timestamp_column="event_timestamp",
+        created_timestamp_column="created",
+        table_subquery="driver_stats",
+        entity_selections=["driver_id AS driver_id"],
+        entity_columns=["driver_id"],
+        min_event_timestamp="2022-01-01 00:00:00",
+        max_event_timestamp="2022-01-02 00:00:00",
+    )
+
+    class OfflineStore:
+        def get_historical_features(self, point_in_time_join_mode="cte", **kwargs):
+            return _build_point_in_time_queries(
+                point_in_time_join_mode,
+                [context],
+                min_timestamp=datetime(2022, 1, 1),
+                max_timestamp=datetime(2022, 1, 2),
+                left_table_query_string="entity_df",
+                entity_df_event_timestamp_col="event_timestamp",
+            )
+
+    provider = AzureProvider.__new__(AzureProvider)
+    provider.offline_store = OfflineStore()
+    staging_queries, query, cleanup_queries = provider.get_historical_features(
+        config=None,
+        feature_views=[],
+        feature_refs=["driver_stats:conv_rate"],
+        entity_df="entity_df",
+        registry=None,
+        project="project",
+        full_feature_names=False,
+        point_in_time_join_mode=point_in_time_join_mode,
+    )
+
+    if point_in_time_join_mode == "temp_tables":
+        assert "#entity_dataframe" in query
+        assert staging_queries and cleanup_queries
+    else:
+        assert "#entity_dataframe" not in query
+        assert staging_queries == cleanup_queries == []
+
+
+class _SourceVersionEngine:
+    """Answers the source version queries of the result cache with a fixed row"""
+
+    def __init__(self, row):
+        self.row = row
+        self.queries = []
+
+    def connect(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def execute(self, query):
+        self.queries.append(str(query))
+        return self
+
+    def fetchone(self):
+        return self.row
+
+
+class _Registry:
+    def __init__(self, version_id: str):
+        self.registry_proto = RegistryProto(version_id=version_id)
+
+    def _get_registry_proto(self, allow_cache: bool = False):
+        return self.registry_proto
+
+
+def _result_cache_key(
+    row=(datetime(2022, 1, 1), 10),
+    version_id="1",
+    driver_ids=(1, 2),
+    check_sources=True,
+):
+    engine = _SourceVersionEngine(row)
+    context = FeatureViewQueryContext(
+        name="driver_stats",
+        ttl=3600,
+        entities=["driver_id"],
+        features=["conv_rate"],
+        table_ref="driver_stats",
+        event_timestamp_column="event_timestamp",
+        created_timestamp_column="",
+        table_subquery="driver_stats",
+        entity_selections=["driver_id AS driver_id"],
+        entity_columns=["driver_id"],
+        min_event_timestamp="2021-12-31 23:00:00",
+        max_event_timestamp="2022-01-02 00:00:00",
+    )
+    key = _get_result_cache_key(
+        engine,
+        _Registry(version_id),
+        [context],
+        pandas.DataFrame({"driver_id": list(driver_ids)}),
+        ["SELECT * FROM feast_entity_df_1"],
+        "feast_entity_df_1",
+        check_sources=check_sources,
+    )
+    return key, engine.queries
+
+
+def test_result_cache_keys_change_with_their_inputs():
+    key, _ = _result_cache_key()
+
+    assert _result_cache_key()[0] == key
+    assert _result_cache_key(row=(datetime(2022, 1, 2), 10))[0] != key
+    # Rows added with an older event timestamp
+    assert _result_cache_key(row=(datetime(2022, 1, 1), 11))[0] != key
+    assert _result_cache_key(version_id="2")[0] != key
+    assert _result_cache_key(driver_ids=(1, 3))[0] != key
+
+
+def test_result_cache_keys_only_query_the_time_range_of_the_retrieval():
+    _, queries = _result_cache_key()
+
+    assert len(queries) == 1
+    assert (
+        "event_timestamp <= CONVERT(DATETIMEOFFSET, '2022-01-02 00:00:00', 120)"
+        in queries[0]
+    )
+    assert (
+        "event_timestamp >= CONVERT(DATETIMEOFFSET, '2021-12-31 23:00:00', 120)"
+        in queries[0]
+    )
+
+
+def test_result_cache_keys_can_skip_the_source_check():
+    key, queries = _result_cache_key(check_sources=False)
+
+    assert queries == []
+    assert _result_cache_key(row=(datetime(2022, 1, 2), 11), check_sources=False)[0] == key
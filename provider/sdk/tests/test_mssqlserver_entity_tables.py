@@ -0,0 +1,98 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import gc
+import threading
+
+import pandas
+import pytest
+import sqlalchemy
+
+from feast_azure_provider.mssqlserver import MsSqlServerOfflineStoreConfig
+from feast_azure_provider.mssqlserver_entity_tables import (
+    EntityTableLease,
+    StagedEntityTables,
+)
+
+
+def test_failed_upload_can_be_retried(tmp_path):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'entities.db'}")
+    tables = StagedEntityTables(engine)
+    entity_df = pandas.DataFrame({"driver_id": [1, 2]})
+    table_name = tables.table_name(entity_df)
+
+    def failing_upload(table_id: str):
+        entity_df.to_sql(name=table_id, con=engine, index=False)
+        raise RuntimeError("upload failed after creating the table")
+
+    with pytest.raises(RuntimeError):
+        tables.acquire(table_name, failing_upload)
+    assert not sqlalchemy.inspect(engine).has_table(table_name)
+
+    tables.acquire(
+        table_name,
+        lambda table_id: entity_df.to_sql(name=table_id, con=engine, index=False),
+    )
+    assert sqlalchemy.inspect(engine).has_table(table_name)
+
+    tables.release(table_name)
+    assert not sqlalchemy.inspect(engine).has_table(table_name)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    return sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'entities.db'}")
+
+
+def _lease(engine, uploads):
+    tables = StagedEntityTables(engine)
+    entity_df = pandas.DataFrame({"driver_id": [1, 2]})
+
+    def upload(table_id: str):
+        uploads.append(table_id)
+        entity_df.to_sql(name=table_id, con=engine, index=False)
+
+    lease = EntityTableLease(tables, tables.table_name(entity_df))
+    lease.acquire(upload)
+    return lease
+
+
+def test_released_leases_are_uploaded_again_to_be_read(engine):
+    uploads = []
+    lease = _lease(engine, uploads)
+
+    with lease.read_reference():
+        lease.release()
+        # The table is kept until the read is done
+        assert sqlalchemy.inspect(engine).has_table(lease.table_name)
+    assert not sqlalchemy.inspect(engine).has_table(lease.table_name)
+
+    with lease.read_reference():
+        assert sqlalchemy.inspect(engine).has_table(lease.table_name)
+    assert not sqlalchemy.inspect(engine).has_table(lease.table_name)
+    assert uploads == [lease.table_name] * 2
+
+
+def test_collected_leases_are_released_in_the_background(engine, monkeypatch):
+    released = threading.Event()
+    release = StagedEntityTables.release
+
+    def record_release(tables, table_name):
+        assert threading.current_thread() is not threading.main_thread()
+        release(tables, table_name)
+        released.set()
+
+    monkeypatch.setattr(StagedEntityTables, "release", record_release)
+    lease = _lease(engine, [])
+    table_name = lease.table_name
+    assert not lease._finalizer.atexit
+
+    del lease
+    gc.collect()
+
+    assert released.wait(timeout=10)
+    assert not sqlalchemy.inspect(engine).has_table(table_name)
+
+
+def test_janitor_is_disabled_by_default():
+    assert MsSqlServerOfflineStoreConfig().staged_entity_table_ttl_seconds == 0
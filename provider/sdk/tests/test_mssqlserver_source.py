@@ -0,0 +1,89 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import pytest
+
+from feast_azure_provider import mssqlserver_source
+from feast_azure_provider.mssqlserver_source import (
+    MsSqlServerSource,
+    invalidate_schema_cache,
+    prefetch_schemas,
+)
+
+
+@pytest.fixture
+def fetched(monkeypatch):
+    """Records the schema queries, which fail for databases named unreachable"""
+    queries = []
+
+    def fetch_schemas(connection_str, database, table_names):
+        queries.append((connection_str, database, sorted(table_names)))
+        if database == "unreachable":
+            raise ConnectionError(f"Could not connect to {database}")
+        with mssqlserver_source._schema_cache_lock:
+            for table_name in table_names:
+                mssqlserver_source._schema_cache[
+                    (connection_str, database.lower(), table_name.lower())
+                ] = (float("inf"), [("driver_id", "bigint")])
+
+    invalidate_schema_cache()
+    monkeypatch.setattr(mssqlserver_source, "_fetch_schemas", fetch_schemas)
+    yield queries
+    invalidate_schema_cache()
+
+
+def _source(table_ref, connection_str="mssql+pyodbc://server"):
+    return MsSqlServerSource(
+        name=table_ref,
+        table_ref=table_ref,
+        connection_str=connection_str,
+        event_timestamp_column="event_timestamp",
+    )
+
+
+def test_sources_without_a_table_to_query_are_skipped(fetched):
+    sources = [
+        _source("driver_hourly"),
+        _source("feast.dbo.driver_hourly"),
+        _source("feast.driver_hourly", connection_str=""),
+        _source("feast.driver_stats"),
+    ]
+
+    prefetch_schemas(sources)
+
+    assert fetched == [("mssql+pyodbc://server", "feast", ["driver_stats"])]
+
+
+def test_failed_databases_dont_affect_the_others(fetched):
+    sources = [_source("unreachable.driver_hourly"), _source("feast.driver_stats")]
+
+    with pytest.warns(UserWarning, match="unreachable"):
+        prefetch_schemas(sources)
+
+    assert list(sources[1].get_table_column_names_and_types()) == [
+        ("driver_id", "bigint")
+    ]
+    with pytest.raises(ConnectionError):
+        sources[0].get_table_column_names_and_types()
+
+
+def test_lookups_only_prefetch_sources_on_the_same_server(fetched):
+    # Sources register themselves while they are alive
+    others = [
+        _source("feast.driver_hourly"),
+        _source("feast.customer_stats", connection_str="mssql+pyodbc://other"),
+        _source("customer_hourly"),
+    ]
+    source = _source("feast.driver_stats")
+
+    source.get_table_column_names_and_types()
+
+    assert len(others) == 3
+    assert fetched == [
+        ("mssql+pyodbc://server", "feast", ["driver_hourly", "driver_stats"])
+    ]
+
+
+def test_lookups_of_sources_without_a_table_to_query_fail(fetched):
+    with pytest.raises(ValueError, match="database.table"):
+        _source("driver_hourly").get_table_column_names_and_types()
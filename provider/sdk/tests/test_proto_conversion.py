@@ -0,0 +1,78 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+from datetime import datetime, timedelta
+
+import pyarrow as pa
+import pytest
+from feast import Field, FileSource
+from feast.feature_view import FeatureView
+from feast.infra.provider import _convert_arrow_to_proto
+from feast.types import Bool, Float64, Int64, String, UnixTimestamp
+from feast.value_type import ValueType
+
+from feast_azure_provider.proto_conversion import convert_arrow_to_proto
+
+
+def _feature_view(schema) -> FeatureView:
+    return FeatureView(
+        name="driver_stats",
+        entities=["driver"],
+        ttl=timedelta(days=1),
+        schema=schema,
+        source=FileSource(
+            path="driver_stats.parquet",
+            timestamp_field="event_timestamp",
+            created_timestamp_column="created",
+        ),
+    )
+
+
+def _table_with_nulls() -> pa.Table:
+    timestamps = [datetime(2022, 1, 1), None, datetime(2022, 1, 3)]
+    return pa.table(
+        {
+            "driver_id": pa.array([1001, 1002, 1003], type=pa.int64()),
+            "trips": pa.array([10, None, 30], type=pa.int64()),
+            "conv_rate": pa.array([0.5, None, float("nan")], type=pa.float64()),
+            "name": pa.array(["a", None, "c"], type=pa.string()),
+            "active": pa.array([True, None, False], type=pa.bool_()),
+            "last_trip": pa.array(timestamps, type=pa.timestamp("us")),
+            "event_timestamp": pa.array(
+                [datetime(2022, 1, 1), datetime(2022, 1, 2), datetime(2022, 1, 3)],
+                type=pa.timestamp("us"),
+            ),
+            "created": pa.array(
+                [datetime(2022, 1, 1), datetime(2022, 1, 2), datetime(2022, 1, 3)],
+                type=pa.timestamp("us"),
+            ),
+        }
+    )
+
+
+def test_conversion_matches_feast_with_nulls():
+    feature_view = _feature_view(
+        [
+            Field(name="trips", dtype=Int64),
+            Field(name="conv_rate", dtype=Float64),
+            Field(name="name", dtype=String),
+            Field(name="active", dtype=Bool),
+            Field(name="last_trip", dtype=UnixTimestamp),
+        ]
+    )
+    table = _table_with_nulls()
+    join_keys = {"driver_id": ValueType.INT64}
+
+    assert convert_arrow_to_proto(
+        table, feature_view, join_keys
+    ) == _convert_arrow_to_proto(table, feature_view, join_keys)
+
+
+@pytest.mark.parametrize("join_keys", [{}, {"driver_id": ValueType.INT64}])
+def test_rows_are_kept_without_join_keys_or_features(join_keys):
+    table = _table_with_nulls()
+
+    rows = convert_arrow_to_proto(table, _feature_view([]), join_keys)
+
+    assert len(rows) == table.num_rows
+    assert all(features == {} for _, features, _, _ in rows)
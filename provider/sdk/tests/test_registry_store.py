@@ -0,0 +1,366 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import itertools
+import json
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+from azure.core import MatchConditions
+from azure.core.exceptions import (
+    ResourceExistsError,
+    ResourceModifiedError,
+    ResourceNotFoundError,
+    ResourceNotModifiedError,
+)
+from feast.protos.feast.core.Entity_pb2 import Entity as EntityProto
+from feast.protos.feast.core.Registry_pb2 import Registry as RegistryProto
+from feast.registry import RegistryConfig
+
+from feast_azure_provider.registry_store import (
+    REGISTRY_WRITE_ATTEMPTS,
+    AzBlobRegistryStore,
+    RegistryConflictError,
+)
+
+REGISTRY_PATH = "https://account.blob.core.windows.net/container/registry.db"
+
+
+class FakeContainer:
+    """In-memory blobs of a container, with the ETag conditions of Azure storage"""
+
+    def __init__(self):
+        self.blobs = {}
+        self.last_modified = {}
+        self.uploads = []
+        self.downloads = []
+        # Called with the name of every blob before it is uploaded
+        self.before_upload = None
+        self._etags = (f'"{i}"' for i in itertools.count())
+
+    def get_blob_client(self, name=None, container=None, blob=None):
+        return FakeBlobClient(self, name or blob)
+
+    def get_container_client(self, container):
+        return self
+
+    def list_blobs(self, name_starts_with=""):
+        return [
+            SimpleNamespace(name=name, last_modified=self.last_modified[name])
+            for name in list(self.blobs)
+            if name.startswith(name_starts_with)
+        ]
+
+    def delete_blob(self, name):
+        self.last_modified.pop(name, None)
+        if self.blobs.pop(name, None) is None:
+            raise ResourceNotFoundError(f"{name} doesn't exist")
+
+
+class FakeBlobClient:
+    def __init__(self, container: FakeContainer, name: str):
+        self._container = container
+        self._name = name
+
+    def download_blob(self, etag=None, match_condition=None):
+        if self._name not in self._container.blobs:
+            raise ResourceNotFoundError(f"{self._name} doesn't exist")
+        data, current_etag = self._container.blobs[self._name]
+        if match_condition == MatchConditions.IfModified and etag == current_etag:
+            raise ResourceNotModifiedError(f"{self._name} wasn't modified")
+        self._container.downloads.append(self._name)
+        return SimpleNamespace(
+            readall=lambda: data, properties=SimpleNamespace(etag=current_etag)
+        )
+
+    def upload_blob(
+        self, data, overwrite=False, etag=None, match_condition=None, **kwargs
+    ):
+        if self._container.before_upload is not None:
+            self._container.before_upload(self._name)
+        current = self._container.blobs.get(self._name)
+        if current is not None and not overwrite:
+            raise ResourceExistsError(f"{self._name} already exists")
+        if match_condition == MatchConditions.IfNotModified and (
+            current is None or current[1] != etag
+        ):
+            raise ResourceModifiedError(f"{self._name} was modified")
+        if isinstance(data, str):
+            data = data.encode()
+        new_etag = next(self._container._etags)
+        self._container.blobs[self._name] = (data, new_etag)
+        self._container.last_modified[self._name] = datetime.now(timezone.utc)
+        self._container.uploads.append(self._name)
+        return {"etag": new_etag}
+
+    def delete_blob(self):
+        self._container.delete_blob(self._name)
+
+
+@pytest.fixture
+def container():
+    return FakeContainer()
+
+
+@pytest.fixture
+def make_store(container, monkeypatch):
+    monkeypatch.setenv("REGISTRY_BLOB_KEY", "key")
+    for name in (
+        "REGISTRY_LAYOUT",
+        "REGISTRY_PROJECTS",
+        "REGISTRY_CACHE_DIR",
+        "REGISTRY_REFRESH_INTERVAL_SECONDS",
+    ):
+        monkeypatch.delenv(name, raising=False)
+
+    def make_store(**environ):
+        for name, value in environ.items():
+            monkeypatch.setenv(name, value)
+        store = AzBlobRegistryStore(RegistryConfig(path=REGISTRY_PATH), None)
+        store._set_blob_clients(container)
+        for name in environ:
+            monkeypatch.delenv(name)
+        return store
+
+    return make_store
+
+
+def _entity(name: str, description: str = "", project: str = "project"):
+    entity = EntityProto()
+    entity.spec.name = name
+    entity.spec.project = project
+    entity.spec.description = description
+    return entity
+
+
+def _registry(*entities) -> RegistryProto:
+    registry_proto = RegistryProto()
+    registry_proto.registry_schema_version = "1"
+    registry_proto.entities.extend(entities)
+    return registry_proto
+
+
+def _entities(registry_proto: RegistryProto):
+    return sorted(
+        (e.spec.project, e.spec.name, e.spec.description)
+        for e in registry_proto.entities
+    )
+
+
+def _read_registry(container: FakeContainer, name="registry.db") -> RegistryProto:
+    registry_proto = RegistryProto()
+    registry_proto.ParseFromString(container.blobs[name][0])
+    return registry_proto
+
+
+def _apply(store: AzBlobRegistryStore, *entities):
+    """Reads the registry like Feast does, and writes it back with entities applied"""
+    try:
+        registry_proto = store.get_registry_proto()
+    except FileNotFoundError:
+        registry_proto = _registry()
+    names = {entity.spec.name for entity in entities}
+    kept = [e for e in registry_proto.entities if e.spec.name not in names]
+    del registry_proto.entities[:]
+    registry_proto.entities.extend(kept + list(entities))
+    store.update_registry_proto(registry_proto)
+
+
+def test_concurrent_writes_are_merged(make_store, container):
+    ours, theirs = make_store(), make_store()
+    _apply(ours, _entity("driver"))
+    registry_proto = ours.get_registry_proto()
+
+    _apply(theirs, _entity("customer"))
+    registry_proto.entities.append(_entity("location"))
+    ours.update_registry_proto(registry_proto)
+
+    assert _entities(_read_registry(container)) == [
+        ("project", "customer", ""),
+        ("project", "driver", ""),
+        ("project", "location", ""),
+    ]
+    # The first upload failed on the ETag, the second one succeeded
+    assert container.uploads == ["registry.db"] * 3
+
+
+def test_conflicting_writes_raise(make_store, container):
+    ours, theirs = make_store(), make_store()
+    _apply(ours, _entity("driver"))
+    registry_proto = ours.get_registry_proto()
+
+    _apply(theirs, _entity("driver", "theirs"))
+    registry_proto.entities[0].spec.description = "ours"
+    with pytest.raises(RegistryConflictError, match="entities project/driver"):
+        ours.update_registry_proto(registry_proto)
+
+    assert _entities(_read_registry(container)) == [("project", "driver", "theirs")]
+
+
+def test_concurrent_creations_are_merged(make_store, container):
+    ours, theirs = make_store(), make_store()
+    with pytest.raises(FileNotFoundError):
+        ours.get_registry_proto()
+
+    _apply(theirs, _entity("customer"))
+    ours.update_registry_proto(_registry(_entity("driver")))
+
+    assert _entities(_read_registry(container)) == [
+        ("project", "customer", ""),
+        ("project", "driver", ""),
+    ]
+
+
+def test_writes_give_up_once_attempts_are_exhausted(make_store, container):
+    ours, theirs = make_store(), make_store()
+    _apply(ours, _entity("driver"))
+    registry_proto = ours.get_registry_proto()
+    registry_proto.entities.append(_entity("location"))
+
+    attempts = []
+
+    def write_concurrently(name):
+        # Another writer always gets in between our read and our upload
+        container.before_upload = None
+        attempts.append(name)
+        _apply(theirs, _entity(f"customer_{len(attempts)}"))
+        container.before_upload = write_concurrently
+
+    container.before_upload = write_concurrently
+    with pytest.raises(RegistryConflictError, match="kept changing"):
+        ours.update_registry_proto(registry_proto)
+
+    assert len(attempts) == REGISTRY_WRITE_ATTEMPTS
+    assert ("project", "location", "") not in _entities(_read_registry(container))
+
+
+@pytest.mark.parametrize("description, conflicts", [("", False), ("changed", True)])
+def test_writes_without_a_read_registry_merge_against_an_empty_one(
+    make_store, container, description, conflicts
+):
+    _apply(make_store(), _entity("driver"))
+    # Nothing was read, so every object written is taken as added by this write
+    store = make_store()
+    registry_proto = _registry(_entity("driver", description), _entity("customer"))
+
+    if conflicts:
+        with pytest.raises(RegistryConflictError, match="entities project/driver"):
+            store.update_registry_proto(registry_proto)
+        return
+    store.update_registry_proto(registry_proto)
+    assert _entities(_read_registry(container)) == [
+        ("project", "customer", ""),
+        ("project", "driver", ""),
+    ]
+
+
+def _shard_names(container: FakeContainer):
+    return {name for name in container.blobs if name.startswith("registry.db.shards/")}
+
+
+def _manifest_shards(container: FakeContainer):
+    return json.loads(container.blobs["registry.db.manifest.json"][0])["shards"]
+
+
+def _two_projects():
+    return [_entity("driver", project="a"), _entity("customer", project="b")]
+
+
+@pytest.mark.parametrize("layout", ["sharded", "sharded_only"])
+def test_sharded_registries_round_trip(make_store, container, layout):
+    _apply(make_store(REGISTRY_LAYOUT=layout), *_two_projects())
+
+    # One shard per project, plus the shard of objects without a project
+    assert set(_manifest_shards(container)) == {"", "a", "b"}
+    assert _shard_names(container) == set(_manifest_shards(container).values())
+    assert _entities(make_store(REGISTRY_LAYOUT=layout).get_registry_proto()) == [
+        ("a", "driver", ""),
+        ("b", "customer", ""),
+    ]
+    assert _entities(
+        make_store(REGISTRY_LAYOUT=layout, REGISTRY_PROJECTS="a").get_registry_proto()
+    ) == [("a", "driver", "")]
+
+    # Clients reading the single blob keep seeing the registry until sharded_only
+    if layout == "sharded":
+        assert _entities(make_store().get_registry_proto()) == [
+            ("a", "driver", ""),
+            ("b", "customer", ""),
+        ]
+    else:
+        assert "registry.db" not in container.blobs
+
+
+def test_writes_of_selected_projects_keep_the_others(make_store, container):
+    _apply(make_store(REGISTRY_LAYOUT="sharded"), *_two_projects())
+    shard_b = _manifest_shards(container)["b"]
+
+    _apply(
+        make_store(REGISTRY_LAYOUT="sharded", REGISTRY_PROJECTS="a"),
+        _entity("driver", "changed", project="a"),
+    )
+
+    assert _manifest_shards(container)["b"] == shard_b
+    assert _entities(make_store().get_registry_proto()) == [
+        ("a", "driver", "changed"),
+        ("b", "customer", ""),
+    ]
+
+
+def test_replaced_shards_are_deleted(make_store, container):
+    store = make_store(REGISTRY_LAYOUT="sharded")
+    _apply(store, *_two_projects())
+    shards = _manifest_shards(container)
+
+    _apply(store, _entity("driver", "changed", project="a"))
+
+    assert shards["a"] not in container.blobs
+    assert _shard_names(container) == set(_manifest_shards(container).values())
+    assert _manifest_shards(container)["b"] == shards["b"]
+
+
+def test_shards_of_failed_writes_are_deleted_once_old(make_store, container):
+    ours, theirs = make_store(REGISTRY_LAYOUT="sharded"), make_store(
+        REGISTRY_LAYOUT="sharded"
+    )
+    _apply(ours, *_two_projects())
+    registry_proto = ours.get_registry_proto()
+
+    _apply(theirs, _entity("driver", "theirs", project="a"))
+    registry_proto.entities[0].spec.description = "ours"
+    with pytest.raises(RegistryConflictError):
+        ours.update_registry_proto(registry_proto)
+    orphans = _shard_names(container) - set(_manifest_shards(container).values())
+    assert len(orphans) == 1
+
+    # Young orphans may belong to a write in progress
+    _apply(theirs, _entity("location", project="b"))
+    assert orphans <= _shard_names(container)
+
+    for name in orphans:
+        container.last_modified[name] -= timedelta(hours=2)
+    _apply(theirs, _entity("location", "changed", project="b"))
+    assert _shard_names(container) == set(_manifest_shards(container).values())
+
+
+def test_single_blob_registries_are_read_conditionally_without_a_manifest(
+    make_store, container
+):
+    _apply(make_store(), *_two_projects())
+    store = make_store(REGISTRY_LAYOUT="sharded", REGISTRY_PROJECTS="b")
+    container.downloads.clear()
+
+    for _ in range(3):
+        assert _entities(store.get_registry_proto()) == [("b", "customer", "")]
+
+    assert container.downloads == ["registry.db"]
+
+
+def test_teardown_deletes_every_shard(make_store, container):
+    store = make_store(REGISTRY_LAYOUT="sharded")
+    _apply(store, *_two_projects())
+
+    store.teardown()
+
+    assert container.blobs == {}
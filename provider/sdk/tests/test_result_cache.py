@@ -0,0 +1,89 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+import os
+import time
+
+import pyarrow
+import pytest
+
+from feast_azure_provider.result_cache import ResultCache
+
+
+def _table(value: int) -> pyarrow.Table:
+    return pyarrow.table({"value": pyarrow.array([value] * 1000, type=pyarrow.int64())})
+
+
+def _entries(cache: ResultCache):
+    return sorted(
+        name[: -len(".arrow")]
+        for name in os.listdir(cache.directory)
+        if name.endswith(".arrow")
+    )
+
+
+def _age(cache: ResultCache, key: str, seconds: int):
+    used = time.time() - seconds
+    os.utime(cache._path(key), (used, used))
+
+
+def test_least_recently_used_entries_are_evicted_by_size(tmp_path):
+    cache = ResultCache(str(tmp_path), max_size_bytes=1 << 40)
+    cache.put("a", _table(1))
+    entry_size = os.path.getsize(cache._path("a"))
+    cache.max_size_bytes = 3 * entry_size
+    cache.put("b", _table(2))
+    cache.put("c", _table(3))
+    for age, key in enumerate(["c", "b", "a"]):
+        _age(cache, key, 100 * (age + 1))
+
+    # Reading a marks it as the most recently used
+    assert cache.get("a") == _table(1)
+    cache.put("d", _table(4))
+
+    assert _entries(cache) == ["a", "c", "d"]
+    cache.put("e", _table(5))
+    assert _entries(cache) == ["a", "d", "e"]
+
+
+def test_entries_larger_than_the_cache_are_evicted(tmp_path):
+    cache = ResultCache(str(tmp_path), max_size_bytes=1)
+
+    cache.put("a", _table(1))
+
+    assert cache.get("a") is None
+    assert not cache.contains("a")
+
+
+def test_batches_are_cached_once_all_read(tmp_path):
+    cache = ResultCache(str(tmp_path), max_size_bytes=1 << 40)
+    batches = _table(1).to_batches(100)
+
+    assert list(cache.put_batches("a", iter(batches))) == batches
+
+    assert cache.get("a") == _table(1)
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+def test_partially_read_batches_are_not_cached(tmp_path):
+    cache = ResultCache(str(tmp_path), max_size_bytes=1 << 40)
+
+    reader = cache.put_batches("a", iter(_table(1).to_batches(100)))
+    next(reader)
+    reader.close()
+
+    assert not cache.contains("a")
+    assert os.listdir(tmp_path) == []
+
+
+def test_failed_reads_are_not_cached(tmp_path):
+    cache = ResultCache(str(tmp_path), max_size_bytes=1 << 40)
+
+    def batches():
+        yield _table(1).to_batches()[0]
+        raise ConnectionError("Connection lost")
+
+    with pytest.raises(ConnectionError):
+        list(cache.put_batches("a", batches()))
+
+    assert os.listdir(tmp_path) == []
@@ -16,6 +16,9 @@ def init():
     redis_conn_str = os.getenv("FEAST_REDIS_CONN")
     feast_registry_path = os.getenv("FEAST_REGISTRY_BLOB")
 
+    # Refresh the registry in the background so that requests never wait on blob storage
+    os.environ.setdefault("REGISTRY_REFRESH_INTERVAL_SECONDS", "60")
+
     print("connecting to registry...")
     reg_config = RegistryConfig(
         registry_store_type="feast_azure_provider.registry_store.AzBlobRegistryStore",